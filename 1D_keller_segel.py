@@ -2,52 +2,68 @@ import numpy as np
 import matplotlib.pyplot as plt
 import imageio
 import os
-import time
+import argparse
 
-logical_dict = {"S":True, "s":True,"N":False, "n":False, "sim":True, "nao":False}
+from KellerSegel_2D import ParametrosKellerSegelModel, KellerSegelModel, capturaFrame
+
+#Non-interactive: the cases, output format and folder come from the command line
+parser = argparse.ArgumentParser(description="Keller-Segel 1D: casos 1 (pontos separados), 2 (sem dinheiro) e 3 (rede aleatória)")
+parser.add_argument("--casos",type=int,nargs="+",choices=[1,2,3],default=[1,2,3],help="Casos a simular")
+parser.add_argument("--formato",choices=["gif","png"],default="gif",help="Gif animado ou imagem com 6 instantes")
+parser.add_argument("--saida",default=".",help="Pasta onde os arquivos são gravados")
+parser.add_argument("--seed",type=int,default=0,help="Semente das condições iniciais aleatórias; o caso c usa seed + c, independente dos outros casos rodados")
+parser.add_argument("--abrir",action="store_true",help="Abre os arquivos gerados com xdg-open")
+args = parser.parse_args()
+
+os.makedirs(args.saida,exist_ok=True)
 
 print("\n")
-def FTCS(p,m,k1,k2,l,k3,v):
-    N = p.shape[0]
-    
-    p_ = np.zeros(N)
-    m_ = np.zeros(N)
-    
-    for j in np.arange(0,N):
-        back = (j-1)%N
-        forward = (j+1)%N
-        p_[j] = (1 - 2*k1 - k2*(m[back] - m[j]))*p[j] + k1*(p[back]+p[forward]) - k2*(m[forward] - m[j])*p[forward]
-        m_[j] = (1 - l - k3)*m[j] + k3*(m[back] + m[forward]) + v*p[j]
-    return p_,m_
+def novo_modelo(p,m):
+    #1D model on the shared N-dimensional engine (same vectorized FTCS stencil as the 2D/3D code)
+    modelo = KellerSegelModel(parametros)
+    modelo.setEstadoInicial(p,m)
+    return modelo
 
-def plot_gif(p,m,t,images, p_max = True, m_max = True):
-    fig,ax = plt.subplots(1,2,figsize=(10,5))
+def plot_gif(p,m,t,images, p_max = True, m_max = True, cache = None):
+    #With a cache dict the figure and artists are built once and only their data is updated on later frames
+    if cache:
+        fig,ax = cache['fig'],cache['ax']
+        cache['line_p'].set_ydata(100*p)
+        cache['line_m'].set_ydata(m)
+        cache['fill_m'].remove()
+        cache['fill_m'] = ax[1].fill_between(np.arange(m.shape[0]),m,color='green',alpha=0.5,label="Total money: $ {}".format(round(np.sum(m),2)))
+        ax[1].legend()
+    else:
+        fig,ax = plt.subplots(1,2,figsize=(10,5))
+        line_p, = ax[0].plot(100*p,color='purple')
+        ax[0].set_ylabel("%")
+        ax[0].grid(False)
+        line_m, = ax[1].plot(m,color='darkgreen')
+        fill_m = ax[1].fill_between(np.arange(m.shape[0]),m,color='green',alpha=0.5,label="Total money: $ {}".format(round(np.sum(m),2)))
+        ax[1].set_ylabel("$")
+        ax[1].grid(False)
+        ax[1].legend()
+        plt.tight_layout()
+        if cache is not None:
+            cache.update(fig=fig,ax=ax,line_p=line_p,line_m=line_m,fill_m=fill_m)
     if not p_max:
         p_max = p.max()
         ax[0].set_ylim(-0.05,100*p_max+0.55)
+    elif cache:
+        ax[0].relim()
+        ax[0].autoscale_view()
     if not m_max:
         m_max = m.max()
         ax[1].set_ylim(-0.02,m_max+0.05)
+    elif cache:
+        ax[1].relim()
+        ax[1].autoscale_view()
     ax[0].set_title("Population, t = {}".format(round(t,1)))
-    ax[0].plot(100*p,color='purple')
-    
-    ax[0].set_ylabel("%")
-    ax[0].grid(False)
     ax[1].set_title("Money, t = {}".format(round(t,1)))
-    ax[1].plot(m,color='darkgreen')
-    ax[1].fill_between(np.arange(m.shape[0]),m,color='green',alpha=0.5,label="Total money: $ {}".format(round(np.sum(m),2)))
     
-    ax[1].set_ylabel("$")
-    ax[1].grid(False)
-    ax[1].legend()
-    
-    plt.tight_layout()
-    plt.savefig(imgname)
-    plt.close()
-    
-    images.append(imageio.imread(imgname))
-    os.remove(imgname)
-    time.sleep(0.5)
+    images.append(capturaFrame(fig)) #Renders straight from the canvas buffer, no temp file
+    if cache is None:
+        plt.close(fig)
 
 def plot_grid(fig,p,m,i,t,nrows=2,ncols=5):
     #Population
@@ -69,8 +85,6 @@ def plot_grid(fig,p,m,i,t,nrows=2,ncols=5):
 
 ##########################################################################################
 """DECLARAÇÃO DE CONSTANTES"""
-gif = True
-global N
 N = 100
 dx = 1
 dt = 0.3
@@ -80,37 +94,17 @@ gamma = 1.0
 alpha = 1.0
 beta = 1.0
 
-k1 = Dp*dt/(dx**2)
-k2 = gamma*k1/Dp
-k3 = Dn*dt/(dx**2)
-v = alpha*dt
-l = beta*dt
+#Periodic 1D grid (L_y = None); the FTCS coefficients k1, k2, k3, v and lamb are computed by the parameters object
+parametros = ParametrosKellerSegelModel(N*dx, None, Dp, Dn, dx, dt, alpha, beta, gamma)
+gif = args.formato == "gif"
 
-imgname = "aux.png"
 ##########################################################################################
 print("=================================================================================")
 print("Caso 1: População e dinheiro em pontos separados")
 print("População começa totalmente concentrada em 1 ponto da rede.")
 print("Dinheiro começa totalmente focado em 1 ponto da rede longe do ponto da população.")
-simulate = logical_dict[input("Deseja essa simulação?(S/N)\n")]
+simulate = 1 in args.casos
 print("=================================================================================")
-if simulate:
-    gif = logical_dict[input("Gif? (S/N)\n")]
-    print("=================================================================================")
-N = 100
-dx = 1
-dt = 0.3
-Dn = 1.0
-Dp = 1.0
-gamma = 1.0
-alpha = 1.0
-beta = 1.0
-
-k1 = Dp*dt/(dx**2)
-k2 = gamma*k1/Dp
-k3 = Dn*dt/(dx**2)
-v = alpha*dt
-l = beta*dt
 
 if simulate:
     N_simulations = 500
@@ -127,17 +121,21 @@ if simulate:
     m_max = m.max()
     
     if gif:
-        path1 = r"/home/rubens22/Desktop/MetCompC/Trabalho1/1D_Simulations/split_money_pop.gif"
+        path1 = os.path.join(args.saida,"split_money_pop.gif")
         #Generate gif
         images = []
+        frame_cache = {}
+        modelo = novo_modelo(p,m)
         for i,t in enumerate(np.arange(0,T,dt)):
+            p,m,_ = modelo.getEstado(copia = False) #Views of the model buffers; only the plotted frames are copied
             if gif:
                 if m.max() > m_max:
                     m_max = m.max()
             if i % 10 == 0:
                 print("Building gif for iteration {}".format(i))
-                plot_gif(p,m,t,images,p_max = 1,m_max = m_max)
-            p,m = FTCS(p,m,k1,k2,l,k3,v)
+                plot_gif(p.copy(),m.copy(),t,images,p_max = 1,m_max = m_max,cache = frame_cache)
+            modelo.atualizaEstado()
+        plt.close(frame_cache['fig'])
         imageio.mimsave(path1, images,fps=3)
     else:
         ncols = 6
@@ -151,19 +149,21 @@ if simulate:
             big_ax.set_title(titles[row],fontsize=22,y=1.15)
             big_ax.axis('off')
         #Figure adjusted
-        path2 = r"/home/rubens22/Desktop/MetCompC/Trabalho1/1D_Simulations/split_money_pop.png"
+        path2 = os.path.join(args.saida,"split_money_pop.png")
         #Generate .png
+        modelo = novo_modelo(p,m)
         for i,t in enumerate(np.arange(0,T,dt)):
+            p,m,_ = modelo.getEstado(copia = False) #Views of the model buffers; only the plotted frames are copied
             if i in snapshots:
                 print("Grid for {} is being build.".format(i))
-                plot_grid(fig,p,m,count,round(t,2),ncols=ncols)
+                plot_grid(fig,p.copy(),m.copy(),count,round(t,2),ncols=ncols)
                 count += 1
-            p,m = FTCS(p,m,k1,k2,l,k3,v)
+            modelo.atualizaEstado()
         fig.subplots_adjust(hspace=0.55)
         plt.savefig(path2)
     print("Image generated!")
     print("#########################")
-    show = logical_dict[input("Quer abrir o arquivo? (S/N)\n")]
+    show = args.abrir
     
     if show:
         if gif:
@@ -176,31 +176,15 @@ print("=========================================================================
 print("Caso 2: Sem dinheiro p/ t = 0")
 print("População começa totalmente concentrada em 1 ponto da rede.")
 print("Dinheiro começa zerado")
-simulate = logical_dict[input("Deseja essa simulação?(S/N)\n")]
+simulate = 2 in args.casos
 print("=================================================================================")
-if simulate:
-    gif = logical_dict[input("Gif? (S/N)\n")]
-    print("=================================================================================")
-N = 100
-dx = 1
-dt = 0.3
-Dn = 1.0
-Dp = 1.0
-gamma = 1.0
-alpha = 1.0
-beta = 1.0
-
-k1 = Dp*dt/(dx**2)
-k2 = gamma*k1/Dp
-k3 = Dn*dt/(dx**2)
-v = alpha*dt
-l = beta*dt
 
 if simulate:
     N_simulations = 500
     T = N_simulations * dt
-    #Setting population for t = 0
-    p1 = np.random.rand(N)
+    #Setting population for t = 0 (own generator: the initial condition does not depend on which other cases run)
+    rng = np.random.default_rng(args.seed + 2)
+    p1 = rng.random(N)
     p = p1 / np.sum(p1)
     p_max = 0.05
     #p[50] = 1
@@ -208,18 +192,22 @@ if simulate:
     m = np.zeros(N)
     m_max = 1
     if gif:
-        path1 = r"/home/rubens22/Desktop/MetCompC/Trabalho1/1D_Simulations/m0.gif"
+        path1 = os.path.join(args.saida,"m0.gif")
         #Generate gif
         images = []
+        frame_cache = {}
+        modelo = novo_modelo(p,m)
         for i,t in enumerate(np.arange(0,T,dt)):
+            p,m,_ = modelo.getEstado(copia = False) #Views of the model buffers; only the plotted frames are copied
             if m.max() > m_max:
                 m_max = m.max()
             if p.max() > p_max:
                 p_max = p.max()
             if i % 10 == 0:
                 print("Building gif for iteration {}".format(i))
-                plot_gif(p,m,t,images,p_max = p_max,m_max = m_max)
-            p,m = FTCS(p,m,k1,k2,l,k3,v)
+                plot_gif(p.copy(),m.copy(),t,images,p_max = p_max,m_max = m_max,cache = frame_cache)
+            modelo.atualizaEstado()
+        plt.close(frame_cache['fig'])
         imageio.mimsave(path1, images,fps=3)
     else:
         ncols = 6
@@ -233,19 +221,21 @@ if simulate:
             big_ax.set_title(titles[row],fontsize=22,y=1.15)
             big_ax.axis('off')
         #Figure adjusted
-        path2 = r"/home/rubens22/Desktop/MetCompC/Trabalho1/1D_Simulations/m0.png"
+        path2 = os.path.join(args.saida,"m0.png")
         #Generate .png
+        modelo = novo_modelo(p,m)
         for i,t in enumerate(np.arange(0,T,dt)):
+            p,m,_ = modelo.getEstado(copia = False) #Views of the model buffers; only the plotted frames are copied
             if i in snapshots:
                 print("Grid for {} is being build.".format(i))
-                plot_grid(fig,p,m,count,round(t,2),ncols=ncols)
+                plot_grid(fig,p.copy(),m.copy(),count,round(t,2),ncols=ncols)
                 count += 1
-            p,m = FTCS(p,m,k1,k2,l,k3,v)
+            modelo.atualizaEstado()
         fig.subplots_adjust(hspace=0.55)
         plt.savefig(path2)
     print("Image generated!")
     print("#########################")
-    show = logical_dict[input("Quer abrir o arquivo? (S/N)\n")]
+    show = args.abrir
     
     if show:
         if gif:
@@ -260,52 +250,39 @@ print("=========================================================================
 print("Caso 3: Rede aleatória")
 print("População começa distribuída aleatoriamente sobre a rede.")
 print("Dinheiro começa totalmente focado em um ponto no meio da rede.")
-simulate = logical_dict[input("Deseja essa simulação?(S/N)\n")]
+simulate = 3 in args.casos
 print("=================================================================================")
-if simulate:
-    gif = logical_dict[input("Gif? (S/N)\n")]
-    print("=================================================================================")
-
-N = 100
-dx = 1
-dt = 0.3
-Dn = 1.0
-Dp = 1.0
-gamma = 1.0
-alpha = 1.0
-beta = 1.0
-
-k1 = Dp*dt/(dx**2)
-k2 = gamma*k1/Dp
-k3 = Dn*dt/(dx**2)
-v = alpha*dt
-l = beta*dt
 
 if simulate:
     N_simulations = 500
     T = N_simulations * dt
     
-    #Setting population for t = 0
-    p1 = np.random.rand(N)
+    #Setting population for t = 0 (own generator: the initial condition does not depend on which other cases run)
+    rng = np.random.default_rng(args.seed + 3)
+    p1 = rng.random(N)
     p = p1 / np.sum(p1)
     p_max = p.max() + 0.05
     
     #Setting money for t = 0
-    m = np.random.rand(N)
+    m = rng.random(N)
     m_max = m.max()
     if gif:
-        path1 = r"/home/rubens22/Desktop/MetCompC/Trabalho1/1D_Simulations/random_population.gif"
+        path1 = os.path.join(args.saida,"random_population.gif")
         #Generate gif
         images = []
+        frame_cache = {}
+        modelo = novo_modelo(p,m)
         for i,t in enumerate(np.arange(0,T,dt)):
+            p,m,_ = modelo.getEstado(copia = False) #Views of the model buffers; only the plotted frames are copied
             if m.max() > m_max:
                 m_max = m.max()
             if p.max() > p_max:
                 p_max = p.max()
             if i % 10 == 0:
                 print("Building gif for iteration {}".format(i))
-                plot_gif(p,m,t,images,p_max = False,m_max = False)
-            p,m = FTCS(p,m,k1,k2,l,k3,v)
+                plot_gif(p.copy(),m.copy(),t,images,p_max = False,m_max = False,cache = frame_cache)
+            modelo.atualizaEstado()
+        plt.close(frame_cache['fig'])
         imageio.mimsave(path1, images,fps=3)
         print("GIF generated!")
     else:
@@ -320,19 +297,21 @@ if simulate:
             big_ax.set_title(titles[row],fontsize=22,y=1.15)
             big_ax.axis('off')
         #Figure adjusted
-        path2 = r"/home/rubens22/Desktop/MetCompC/Trabalho1/1D_Simulations/random_population.png"
+        path2 = os.path.join(args.saida,"random_population.png")
         #Generate .png
+        modelo = novo_modelo(p,m)
         for i,t in enumerate(np.arange(0,T,dt)):
+            p,m,_ = modelo.getEstado(copia = False) #Views of the model buffers; only the plotted frames are copied
             if i in snapshots:
                 print("Grid for {} is being build.".format(i))
-                plot_grid(fig,p,m,count,round(t,2),ncols=ncols)
+                plot_grid(fig,p.copy(),m.copy(),count,round(t,2),ncols=ncols)
                 count += 1
-            p,m = FTCS(p,m,k1,k2,l,k3,v)
+            modelo.atualizaEstado()
         fig.subplots_adjust(hspace=0.55)
         plt.savefig(path2)
         print("Image generated!")
     print("#########################")
-    show = logical_dict[input("Quer abrir o arquivo? (S/N)\n")]
+    show = args.abrir
     
     if show:
         if gif:
@@ -2,22 +2,51 @@ import os
 import imageio
 import numpy as np
 import time
+import functools
+import random
+import contextlib
+import copy
+import json
+import glob
+import multiprocessing
+import threading
+import queue
+import weakref
+from multiprocessing import shared_memory
+import warnings
 import matplotlib
 from mpl_toolkits import mplot3d
 import matplotlib.pyplot as plt
 import matplotlib.animation as animation
-
-class ParametrosKellerSegelModel():
-    def __init__(self, L_x, L_y,D_p, D_m, ds, dt, alfa, beta, gamma):
-        self.L_x = L_x # Tamanho em x
-        self.L_y = L_y # Tamanho em y
+from matplotlib.backends.backend_agg import FigureCanvasAgg
+
+try:
+    import h5py # Opcional: só é necessário para gravar snapshots em HDF5
+except ImportError:
+    h5py = None
+
+try:
+    import numba # Opcional: só é necessário para o método 'numba'
+except ImportError:
+    numba = None
+
+class ParametrosKellerSegelModel(): # Grade periódica 1D (L_y = None), 2D ou 3D (com L_z)
+    def __init__(self, L_x, L_y,D_p, D_m, ds, dt, alfa, beta, gamma, dtype = np.float64, L_z = None):
+        if L_y is None and L_z is not None:
+            raise ValueError("Uma grade 3D precisa de L_y")
+
+        # A geometria (L_x, L_y, L_z, ds) é somente leitura: formato, N_*, os k's e o cache de coordenadas dependem dela
+        self._L_x = L_x # Tamanho em x
+        self._L_y = L_y # Tamanho em y (None na grade 1D)
+        self._L_z = L_z # Tamanho em z (só na grade 3D)
+        self._ds = ds # Diferencial espacial
         self.D_p = D_p # Coeficiente de difusão da população
         self.D_m = D_m # Coeficiente de difusão da economia
-        self.ds = ds # Diferencial espacial
         self.dt = dt # Diferencial temporal
         self.alfa = alfa # taxa de produção de economia per capita
         self.beta = beta # taxa de decaimente da economia
         self.gamma = gamma # velocidade com que as pessoas migram em direção ao dinheiro
+        self.dtype = np.dtype(dtype) # Tipo dos estados (float32 usa metade da memória; ver verificaPrecisaoDtype)
 
         self.k1 = D_p * dt / (ds ** 2)
         self.k2 = gamma * self.k1 / D_p
@@ -25,16 +54,72 @@ class ParametrosKellerSegelModel():
         self.v = alfa * dt
         self.lamb = beta * dt
 
-        self.N_x = int(np.ceil(L_x / ds)) # Arredonda pra cima
-        self.N_y = int(np.ceil(L_y / ds)) # Arredonda pra cima
-
-        self.x = np.arange(0, L_x, ds) # Lista dos x
-        self.y = np.arange(0, L_y, ds) # Lista dos y
+        comprimentos = [L for L in (L_x, L_y, L_z) if L is not None]
+        self.dimensao = len(comprimentos) # 1, 2 ou 3
+        self.formato = tuple(int(np.ceil(L / ds)) for L in comprimentos) # Arredonda pra cima; (N_x,), (N_x, N_y) ou (N_x, N_y, N_z)
+
+        self.N_x = self.formato[0]
+        self.N_y = self.formato[1] if self.dimensao > 1 else None
+        self.N_z = self.formato[2] if self.dimensao > 2 else None
+
+        self._cache = {} # Coordenadas e malhas, construídas uma vez por passo na primeira vez que são pedidas
+
+    @property
+    def L_x(self):
+        return self._L_x
+
+    @property
+    def L_y(self):
+        return self._L_y
+
+    @property
+    def L_z(self):
+        return self._L_z
+
+    @property
+    def ds(self):
+        return self._ds
+
+    def coordenadas(self, passo = 1): # Coordenadas de cada eixo tomadas a cada 'passo' pontos, somente leitura
+        cache = self._cache
+        chave = ('coordenadas', passo)
+        if chave not in cache:
+            comprimentos = [L for L in (self.L_x, self.L_y, self.L_z) if L is not None]
+            eixos = []
+            for L in comprimentos:
+                eixo = np.arange(0, L, self.ds)[::passo]
+                eixo.flags.writeable = False
+                eixos.append(eixo)
+            cache[chave] = tuple(eixos)
+        return cache[chave]
+
+    def malha(self, passo = 1): # np.meshgrid das coordenadas (a cada 'passo' pontos), como os plots usam; construída uma vez e somente leitura
+        cache = self._cache
+        chave = ('malha', passo)
+        if chave not in cache:
+            malha = tuple(np.meshgrid(*self.coordenadas(passo)))
+            for eixo in malha:
+                eixo.flags.writeable = False
+            cache[chave] = malha
+        return cache[chave]
+
+    @property
+    def x(self): # Lista dos x
+        return self.coordenadas()[0]
+
+    @property
+    def y(self): # Lista dos y (None na grade 1D)
+        return self.coordenadas()[1] if self.dimensao > 1 else None
+
+    @property
+    def z(self): # Lista dos z (só na grade 3D)
+        return self.coordenadas()[2] if self.dimensao > 2 else None
 
     def getParametros(self):
         return {
             'L_x' : self.L_x,
             'L_y' : self.L_y,
+            'L_z' : self.L_z,
             'D_p' : self.D_p,
             'D_m' : self.D_m,
             'ds' : self.ds,
@@ -42,6 +127,8 @@ class ParametrosKellerSegelModel():
             'alfa' : self.alfa,
             'beta' : self.beta,
             'gamma' : self.gamma,
+            'dtype' : self.dtype,
+            'dimensao' : self.dimensao,
             'k1': self.k1,
             'k2': self.k2,
             'k3': self.k3,
@@ -49,30 +136,756 @@ class ParametrosKellerSegelModel():
             'lamb': self.lamb,
             'x': self.x,
             'y': self.y,
+            'z': self.z,
         }
 
+def rolaPeriodico(u, deslocamento, eixo, saida): # Equivalente a np.roll(u, deslocamento (±1), axis=eixo), mas escrevendo em saida já alocada
+    origem = [slice(None)] * u.ndim
+    destino = [slice(None)] * u.ndim
+    if deslocamento == 1: # saida[i] = u[i - 1]
+        destino[eixo], origem[eixo] = slice(1, None), slice(None, -1)
+        saida[tuple(destino)] = u[tuple(origem)]
+        destino[eixo], origem[eixo] = 0, -1
+    else: # saida[i] = u[i + 1]
+        destino[eixo], origem[eixo] = slice(None, -1), slice(1, None)
+        saida[tuple(destino)] = u[tuple(origem)]
+        destino[eixo], origem[eixo] = -1, 0
+    saida[tuple(destino)] = u[tuple(origem)]
+    return saida
+
+def alocaRascunho(formato, dtype = np.float64, dimensao = None): # Arrays de trabalho do FTCSND: 4 vizinhos deslocados por eixo e 3 temporários
+    dimensao = dimensao or len(formato)
+    nomes = [f'{campo}_{sentido}_{eixo}' for eixo in range(dimensao) for campo in ('p', 'm') for sentido in ('previous', 'next')]
+    return {nome: np.empty(formato, dtype=dtype) for nome in nomes + ['a', 'b', 'c']}
+
+def FTCSND(pn, mn, k1, k2, k3, lamb, v, pn1 = None, mn1 = None, rascunho = None, dimensao = None): # Um passo do FTCS nos 'dimensao' últimos eixos (padrão: todos); eixos anteriores (ex.: membros de um ensemble) são independentes
+    # Com pn1, mn1 e rascunho já alocados o passo não aloca memória; em 2D a ordem das operações é a mesma do laço escalar (resultado idêntico bit a bit)
+    dimensao = dimensao or pn.ndim
+    if pn1 is None:
+        pn1 = np.empty_like(pn)
+    if mn1 is None:
+        mn1 = np.empty_like(mn)
+    if rascunho is None:
+        rascunho = alocaRascunho(pn.shape, pn.dtype, dimensao)
+    r = rascunho
+
+    # Vizinhos deslocados em cada eixo, com o contorno periódico (i - 1) % N_x, (i + 1) % N_x, etc.
+    eixos = range(dimensao)
+    p_previous = [rolaPeriodico(pn, 1, e - dimensao, r[f'p_previous_{e}']) for e in eixos]
+    p_next = [rolaPeriodico(pn, -1, e - dimensao, r[f'p_next_{e}']) for e in eixos]
+    m_previous = [rolaPeriodico(mn, 1, e - dimensao, r[f'm_previous_{e}']) for e in eixos]
+    m_next = [rolaPeriodico(mn, -1, e - dimensao, r[f'm_next_{e}']) for e in eixos]
+
+    a, b, c = r['a'], r['b'], r['c']
+
+    # pn1 = pn * (1 - 2d k1 - k2 (Σ m_previous - d mn)) + k1 (Σ p_previous + Σ p_next) - k2 Σ p_next (m_next - mn)
+    np.multiply(mn, dimensao, out=a)
+    np.subtract(m_previous[0], a, out=a)
+    for m_e in m_previous[1:]:
+        np.add(a, m_e, out=a)
+    np.multiply(a, k2, out=a)
+    np.subtract(1 - 2 * dimensao * k1, a, out=a)
+    np.multiply(pn, a, out=a)
+
+    vizinhos = p_previous + p_next
+    np.add(vizinhos[0], vizinhos[1], out=b)
+    for p_e in vizinhos[2:]:
+        np.add(b, p_e, out=b)
+    np.multiply(b, k1, out=b)
+    np.add(a, b, out=a)
+
+    np.subtract(m_next[0], mn, out=b)
+    np.multiply(p_next[0], b, out=b)
+    for p_e, m_e in zip(p_next[1:], m_next[1:]):
+        np.subtract(m_e, mn, out=c)
+        np.multiply(p_e, c, out=c)
+        np.add(b, c, out=b)
+    np.multiply(b, k2, out=b)
+    np.subtract(a, b, out=pn1)
+
+    # mn1 = mn * (1 - 2d k3 - lamb) + k3 (Σ m_previous + Σ m_next) + v pn
+    np.multiply(mn, 1 - 2 * dimensao * k3 - lamb, out=mn1)
+    vizinhos = m_previous + m_next
+    np.add(vizinhos[0], vizinhos[1], out=a)
+    for m_e in vizinhos[2:]:
+        np.add(a, m_e, out=a)
+    np.multiply(a, k3, out=a)
+    np.add(mn1, a, out=mn1)
+    np.multiply(pn, v, out=a)
+    np.add(mn1, a, out=mn1)
+
+    return pn1, mn1
+
+def termoQuimiotaxiaND(pn, mn, dimensao = None): # Parte de quimiotaxia do FTCS (multiplicada por -k2 no passo), nos 'dimensao' últimos eixos
+    dimensao = dimensao or pn.ndim
+    eixos = range(-dimensao, 0)
+
+    soma_m_previous = np.roll(mn, 1, axis=eixos[0]) - dimensao * mn
+    for e in eixos[1:]:
+        soma_m_previous = soma_m_previous + np.roll(mn, 1, axis=e)
+
+    termo = pn * soma_m_previous
+    for e in eixos:
+        termo = termo + np.roll(pn, -1, axis=e) * (np.roll(mn, -1, axis=e) - mn)
+    return termo
+
+@functools.lru_cache(maxsize=8) # Cada entrada é uma grade inteira: poucos formatos bastam
+def simboloLaplacianoND(formato): # Autovalores do laplaciano discreto de 2d + 1 pontos com contorno periódico, no layout do rfftn
+    simbolo = np.zeros(formato[:-1] + (formato[-1] // 2 + 1,))
+    for eixo, N in enumerate(formato):
+        theta = 2 * np.pi * (np.fft.rfftfreq(N) if eixo == len(formato) - 1 else np.fft.fftfreq(N))
+        forma = [1] * len(formato)
+        forma[eixo] = -1
+        simbolo = simbolo + (2 * np.cos(theta) - 2).reshape(forma)
+    simbolo.setflags(write=False) # Compartilhado entre modelos pelo cache
+    return simbolo
+
+@functools.lru_cache(maxsize=8) # Duas grades por entrada; uma varredura em D_m ou beta criaria uma entrada por combinação
+def simboloDinheiroEspectral(formato, k3, lamb): # Propagador exato da equação do dinheiro em um passo, com p constante no passo; compartilhado entre passos e modelos com os mesmos parâmetros
+    a = k3 * simboloLaplacianoND(formato) - lamb # Autovalores de (k3 L - lamb), já multiplicados por dt
+    propagador = np.exp(a)
+
+    # (e^a - 1) / a, com o limite 1 quando a -> 0 (modo constante sem decaimento)
+    fonte = np.ones_like(a)
+    nao_nulo = np.abs(a) > 1e-12
+    fonte[nao_nulo] = np.expm1(a[nao_nulo]) / a[nao_nulo]
+
+    propagador.setflags(write=False)
+    fonte.setflags(write=False)
+    return propagador, fonte
+
+@functools.lru_cache(maxsize=None)
+def fasesPeriodicas(N): # cos e sen de 2π i / N: o centro de massa numa grade periódica é a média circular das posições
+    theta = 2 * np.pi * np.arange(N) / N
+    cos, sin = np.cos(theta), np.sin(theta)
+    cos.setflags(write=False)
+    sin.setflags(write=False)
+    return cos, sin
+
+def laplacianoND(u, dimensao = None): # Laplaciano discreto de 2d + 1 pontos (sem o fator 1/ds²) com contorno periódico, nos 'dimensao' últimos eixos
+    dimensao = dimensao or u.ndim
+    soma = 0
+    for e in range(-dimensao, 0):
+        soma = soma + np.roll(u, 1, axis=e) + np.roll(u, -1, axis=e)
+    return soma - 2 * dimensao * u
+
+def residuoEstacionarioND(pn, mn, D_p, D_m, gamma, alfa, beta, ds): # (∂p/∂t, ∂m/∂t) do sistema semidiscreto que o FTCS integra; o estado estacionário de todos os métodos é o zero dele
+    residuo_p = (D_p * laplacianoND(pn) - gamma * termoQuimiotaxiaND(pn, mn)) / ds ** 2
+    residuo_m = D_m * laplacianoND(mn) / ds ** 2 - beta * mn + alfa * pn
+    return residuo_p, residuo_m
+
+def resolveGMRES(aplica, b, precondiciona, tolerancia = 1e-3, max_iteracoes = 40): # GMRES (sem reinício, precondicionado à direita): x com ||aplica(x) - b|| <= tolerancia ||b||, ou o melhor em max_iteracoes
+    norma_b = float(np.sqrt(np.vdot(b, b)))
+    if norma_b == 0:
+        return np.zeros_like(b)
+
+    base = [b / norma_b] # Base de Krylov ortonormal
+    H = np.zeros((max_iteracoes + 1, max_iteracoes)) # Hessenberg de Arnoldi
+    for j in range(max_iteracoes):
+        w = aplica(precondiciona(base[j]))
+        for i in range(j + 1): # Gram-Schmidt modificado
+            H[i, j] = np.vdot(base[i], w)
+            w = w - H[i, j] * base[i]
+        H[j + 1, j] = np.sqrt(np.vdot(w, w))
+
+        lado_direito = np.zeros(j + 2)
+        lado_direito[0] = norma_b
+        y = np.linalg.lstsq(H[:j + 2, :j + 1], lado_direito, rcond=None)[0]
+        residuo = np.linalg.norm(lado_direito - H[:j + 2, :j + 1] @ y)
+        if residuo <= tolerancia * norma_b or H[j + 1, j] == 0:
+            break
+        base.append(w / H[j + 1, j])
+
+    return precondiciona(sum(y_i * v for y_i, v in zip(y, base)))
+
+def capturaFrame(figura): # Renderiza a figura com o Agg e devolve a imagem RGB como array, sem passar pelo disco
+    canvas = FigureCanvasAgg(figura)
+    canvas.draw()
+    return np.asarray(canvas.buffer_rgba())[:, :, :3].copy()
+
+def malhaPlot(x, y): # Malha (X, Y) dos plots: usa a malha pronta (ParametrosKellerSegelModel.malha()) ou, com as coordenadas 1D, monta uma com np.meshgrid
+    if np.ndim(x) == 2:
+        return x, y
+    return np.meshgrid(x, y)
+
+REDUCOES = ('media', 'maximo') # 'media' suaviza; 'maximo' preserva os picos (max-pooling)
+
+def reduzResolucao(campo, fator, modo = 'media'): # Reduz cada eixo do campo em blocos de 'fator' pontos (o último bloco pode ser menor), pela média ou pelo máximo de cada bloco
+    if modo not in REDUCOES:
+        raise ValueError(f"Redução desconhecida: {modo}. Use uma de {REDUCOES}")
+    if fator <= 1:
+        return campo
+
+    campo = np.asarray(campo)
+    for eixo in range(campo.ndim):
+        inicios = np.arange(0, campo.shape[eixo], fator)
+        if modo == 'maximo':
+            campo = np.maximum.reduceat(campo, inicios, axis = eixo)
+        else:
+            tamanhos = np.diff(np.append(inicios, campo.shape[eixo])) # Pontos de cada bloco
+            formato = [1] * campo.ndim
+            formato[eixo] = -1
+            campo = np.add.reduceat(campo, inicios, axis = eixo) / tamanhos.reshape(formato)
+    return campo
+
+def fatorResolucao(formato, orcamento): # Menor fator de redução com o qual a grade reduzida tem no máximo 'orcamento' pontos (1 se já cabe)
+    fator = max(1, int(np.ceil((np.prod(formato) / orcamento) ** (1 / len(formato)))))
+    while np.prod([-(-n // fator) for n in formato]) > orcamento: # Arredondamento do último bloco
+        fator += 1
+    return fator
+
+def reduzParaRender(x, y, populacao, dinheiro, orcamento = None, modo = 'media'): # Leva os campos (e a malha dos plots) a no máximo 'orcamento' pontos; sem orcamento, ou se a grade já cabe, devolve os campos como estão
+    X, Y = malhaPlot(x, y)
+    if orcamento is None:
+        return X, Y, populacao, dinheiro
+
+    fator = fatorResolucao(np.shape(populacao), orcamento)
+    if fator == 1:
+        return X, Y, populacao, dinheiro
+    # A malha é tomada a cada 'fator' pontos (fatias, sem cópia): cada bloco fica na coordenada do seu primeiro ponto
+    return X[::fator, ::fator], Y[::fator, ::fator], reduzResolucao(populacao, fator, modo), reduzResolucao(dinheiro, fator, modo)
+
+class Perfilador(): # Mede o tempo de cada fase (passo, verificação, contagem, plot, frame, gif...) com contagens e percentis; fases podem ser aninhadas
+    PERCENTIS = (50, 90, 99)
+    AMOSTRAS = 4096 # Durações guardadas por fase para os percentis (amostragem por reservatório): a memória não cresce com a duração da execução
+
+    def __init__(self, guarda_eventos = False, callback = None):
+        self.guarda_eventos = guarda_eventos # Guarda (início, duração) de cada medida para exportaTrace; a memória cresce com o número de medidas
+        self.callback = callback # Chamado como callback(nome, inicio, duracao) ao fim de cada fase, em segundos desde a criação do perfilador
+        self.fases = {} # nome -> [contagem, total, mínimo, máximo] em ns
+        self.amostras = {} # nome -> até AMOSTRAS durações em ns, uma amostra uniforme de todas as medidas
+        self.pilhas = {} # pilha de nomes -> tempo próprio em ns (sem as fases aninhadas), para exportaPilhas
+        self.eventos = [] # (pilha de nomes, início em ns, duração em ns), só com guarda_eventos
+        self.pilha = []
+        self.origem = time.perf_counter_ns()
+        self.sorteio = random.Random(0) # Gerador próprio: o reservatório não mexe no estado do np.random que os checkpoints guardam
+
+    def fase(self, nome): # Uso: with perfilador.fase('passo'): ...
+        self.pilha.append([nome, 0])
+        return self
+
+    def __enter__(self):
+        self.pilha[-1][1] = time.perf_counter_ns()
+        return self
+
+    def __exit__(self, *args):
+        fim = time.perf_counter_ns()
+        nome, inicio = self.pilha[-1]
+        duracao = fim - inicio
+        self.__registra(nome, duracao)
+
+        pilha = tuple(item[0] for item in self.pilha)
+        self.pilhas[pilha] = self.pilhas.get(pilha, 0) + duracao
+        if len(pilha) > 1: # O tempo de uma fase aninhada não conta como tempo próprio da fase de fora
+            self.pilhas[pilha[:-1]] = self.pilhas.get(pilha[:-1], 0) - duracao
+        if self.guarda_eventos:
+            self.eventos.append((pilha, inicio - self.origem, duracao))
+
+        self.pilha.pop()
+        if self.callback is not None:
+            self.callback(nome, (inicio - self.origem) / 1e9, duracao / 1e9)
+
+    def __registra(self, nome, duracao): # Atualiza os agregados da fase e o reservatório de amostras
+        agregado = self.fases.get(nome)
+        if agregado is None:
+            self.fases[nome] = [1, duracao, duracao, duracao]
+            self.amostras[nome] = [duracao]
+            return
+        agregado[0] += 1
+        agregado[1] += duracao
+        agregado[2] = min(agregado[2], duracao)
+        agregado[3] = max(agregado[3], duracao)
+
+        amostras = self.amostras[nome]
+        if len(amostras) < self.AMOSTRAS:
+            amostras.append(duracao)
+        else: # Algoritmo R: a k-ésima medida substitui uma amostra com probabilidade AMOSTRAS / k
+            posicao = self.sorteio.randrange(agregado[0])
+            if posicao < self.AMOSTRAS:
+                amostras[posicao] = duracao
+
+    def resumo(self): # {fase: contagem, total, média, mínimo, máximo e percentis}, em segundos; os percentis são exatos até AMOSTRAS medidas
+        resumo = {}
+        for nome, (contagem, total, minimo, maximo) in self.fases.items():
+            amostras = np.asarray(self.amostras[nome]) / 1e9
+            resumo[nome] = {
+                'contagem': contagem,
+                'total': total / 1e9,
+                'media': total / contagem / 1e9,
+                'minimo': minimo / 1e9,
+                'maximo': maximo / 1e9,
+                **{f'p{p}': float(v) for p, v in zip(self.PERCENTIS, np.percentile(amostras, self.PERCENTIS))},
+            }
+        return resumo
+
+    def exportaJSON(self, caminho): # Grava o resumo
+        with open(caminho, 'w') as f:
+            json.dump(self.resumo(), f, indent=4)
+
+    def exportaTrace(self, caminho): # Grava os eventos no formato Trace Event (chrome://tracing, Perfetto, speedscope), que mostra as fases como um flame graph no tempo
+        if not self.guarda_eventos:
+            raise ValueError("exportaTrace precisa dos eventos: crie o perfilador com Perfilador(guarda_eventos=True)")
+        eventos = [{'name': pilha[-1], 'ph': 'X', 'ts': inicio / 1e3, 'dur': duracao / 1e3, 'pid': os.getpid(), 'tid': 0}
+                   for pilha, inicio, duracao in self.eventos]
+        with open(caminho, 'w') as f:
+            json.dump({'traceEvents': eventos, 'displayTimeUnit': 'ms'}, f)
+
+    def exportaPilhas(self, caminho): # Grava as pilhas no formato "a;b;c microssegundos" do flamegraph.pl, com o tempo próprio de cada pilha
+        with open(caminho, 'w') as f:
+            for pilha, duracao in self.pilhas.items():
+                f.write(f"{';'.join(pilha)} {max(duracao, 0) // 1000}\n")
+
+SEM_PERFIL = contextlib.nullcontext() # Contexto vazio reaproveitado: com o perfilador desligado, medir uma fase custa só um teste de None
+
+def medeFase(perfilador, nome): # with medeFase(self.perfilador, 'passo'): ... mede a fase se houver perfilador
+    return perfilador.fase(nome) if perfilador is not None else SEM_PERFIL
+
+ACUMULADORES = 8 # Por linha da grade no kernel numba: Σp, Σm, max p, j do max p, max m, j do max m, Σ p cos(2π j / N_y), Σ p sen(2π j / N_y)
+
+def medidasND(populacao, dinheiro): # Medidas dos diagnósticos calculadas sobre a grade, quando o passo não as acumulou (uma soma por eixo e um argmax por campo)
+    eixos = range(populacao.ndim)
+    momentos = []
+    for e in eixos:
+        marginal = populacao.sum(axis=tuple(o for o in eixos if o != e), dtype=np.float64) # Somas em float64 mesmo em grades float32: a deriva é pequena
+        cos, sin = fasesPeriodicas(populacao.shape[e])
+        momentos.append((float(cos @ marginal), float(sin @ marginal)))
+
+    indice_p = np.unravel_index(np.argmax(populacao), populacao.shape)
+    indice_m = np.unravel_index(np.argmax(dinheiro), dinheiro.shape)
+    return {
+        'populacao': float(marginal.sum()),
+        'dinheiro': float(dinheiro.sum(dtype=np.float64)),
+        'pico_populacao': float(populacao[indice_p]),
+        'indice_pico_populacao': tuple(int(i) for i in indice_p),
+        'pico_dinheiro': float(dinheiro[indice_m]),
+        'indice_pico_dinheiro': tuple(int(i) for i in indice_m),
+        'momentos': momentos,
+    }
+
+def medidasAcumuladas(acumuladores): # As mesmas medidas de medidasND, a partir das somas por linha feitas pelo kernel numba no próprio passo (só O(N_x) aqui)
+    soma_p, soma_m, max_p, j_max_p, max_m, j_max_m, cos_p, sin_p = acumuladores.T
+    i_p = int(np.argmax(max_p))
+    i_m = int(np.argmax(max_m))
+    cos_x, sin_x = fasesPeriodicas(len(acumuladores))
+    return {
+        'populacao': float(soma_p.sum()),
+        'dinheiro': float(soma_m.sum()),
+        'pico_populacao': float(max_p[i_p]),
+        'indice_pico_populacao': (i_p, int(j_max_p[i_p])),
+        'pico_dinheiro': float(max_m[i_m]),
+        'indice_pico_dinheiro': (i_m, int(j_max_m[i_m])),
+        'momentos': [(float(cos_x @ soma_p), float(sin_x @ soma_p)), (float(cos_p.sum()), float(sin_p.sum()))],
+    }
+
+class Diagnosticos(): # Série temporal de população e dinheiro totais, picos (valor e posição), centro de massa e deriva da massa, registrada pelo modelo durante os passos
+    CAMPOS = ('passo', 'tempo', 'populacao', 'dinheiro', 'pico_populacao', 'posicao_pico_populacao', 'pico_dinheiro', 'posicao_pico_dinheiro',
+              'centro_massa', 'deriva_populacao', 'deriva_dinheiro')
+
+    def __init__(self, intervalo = 1):
+        self.intervalo = intervalo # Passos entre registros
+        self.limpa()
+
+    def limpa(self): # Recomeça a série (o modelo chama em setEstadoInicial)
+        self.serie = {campo: [] for campo in self.CAMPOS}
+
+    def registra(self, passo, tempo, medidas, formato, ds, mapa_dinheiro, referencia = False): # Acrescenta um registro; mapa_dinheiro = (a, b), com M^{n+1} = a M^n + b P^n a evolução exata do dinheiro total no esquema do modelo
+        # Com referencia = True o registro só serve de referência para a deriva dos seguintes (ex.: depois de passos com outro dt)
+        # Centro de massa da população: média circular em cada eixo, levada de volta para [0, L)
+        centro = tuple(float(np.arctan2(sin, cos) % (2 * np.pi) / (2 * np.pi) * N * ds) for (cos, sin), N in zip(medidas['momentos'], formato))
+
+        # Deriva por passo desde o registro anterior: a população total não muda no esquema e o dinheiro segue o mapa (a, b)
+        deriva_populacao = deriva_dinheiro = float('nan')
+        if self.serie['passo'] and not referencia:
+            k = passo - self.serie['passo'][-1]
+            P, M = self.serie['populacao'][-1], self.serie['dinheiro'][-1]
+            a, b = mapa_dinheiro
+            M_previsto = a ** k * M + b * P * (k if a == 1 else (1 - a ** k) / (1 - a))
+            deriva_populacao = (medidas['populacao'] - P) / k
+            deriva_dinheiro = (medidas['dinheiro'] - M_previsto) / k
+
+        registro = {
+            'passo': passo,
+            'tempo': tempo,
+            'populacao': medidas['populacao'],
+            'dinheiro': medidas['dinheiro'],
+            'pico_populacao': medidas['pico_populacao'],
+            'posicao_pico_populacao': tuple(i * ds for i in medidas['indice_pico_populacao']),
+            'pico_dinheiro': medidas['pico_dinheiro'],
+            'posicao_pico_dinheiro': tuple(i * ds for i in medidas['indice_pico_dinheiro']),
+            'centro_massa': centro,
+            'deriva_populacao': deriva_populacao,
+            'deriva_dinheiro': deriva_dinheiro,
+        }
+        for campo in self.CAMPOS:
+            self.serie[campo].append(registro[campo])
+
+    def ultimo(self, passo = None): # Último registro como dict; com passo, só se ele for desse passo (senão None)
+        if not self.serie['passo'] or (passo is not None and self.serie['passo'][-1] != passo):
+            return None
+        return {campo: self.serie[campo][-1] for campo in self.CAMPOS}
+
+    def arrays(self): # A série como arrays NumPy (posições e centro de massa com um eixo por coordenada)
+        return {campo: np.array(valores) for campo, valores in self.serie.items()}
+
+if numba is not None:
+    @numba.njit(parallel=True, cache=True)
+    def FTCS2DNumba(pn, mn, c1, k1, k2, c3, k3, v, pn1, mn1, acumuladores, cos_y, sin_y): # Mesmo passo do FTCSND em 2D, calculado em uma única passada pela grade e escrito em pn1/mn1 já alocados
+        # c1 = 1 - 4 k1 e c3 = 1 - 4 k3 - lamb vêm prontos, no dtype dos estados: um literal inteiro aqui promoveria as contas em float32 para float64
+        # Com acumuladores (N_x, ACUMULADORES), a mesma passada soma por linha as medidas dos diagnósticos do novo estado; com (0, ACUMULADORES), não
+        N_x, N_y = pn.shape
+        diagnostico = acumuladores.shape[0] > 0
+        for i in numba.prange(N_x): # Linhas em paralelo
+            i_previous = (i - 1) % N_x
+            i_next = (i + 1) % N_x
+            for j in range(N_y):
+                j_previous = (j - 1) % N_y
+                j_next = (j + 1) % N_y
+
+                m = mn[i, j]
+                pn1[i, j] = pn[i, j] * (c1 - k2 * (mn[i_previous, j] - (m + m) + mn[i, j_previous])) \
+                          + k1 * (pn[i_previous, j] + pn[i, j_previous] + pn[i_next, j] + pn[i, j_next]) \
+                          - k2 * (pn[i_next, j] * (mn[i_next, j] - m) + pn[i, j_next] * (mn[i, j_next] - m))
+
+                mn1[i, j] = m * c3 + k3 * (mn[i_previous, j] + mn[i, j_previous] + mn[i_next, j] + mn[i, j_next]) + v * pn[i, j]
+
+            if diagnostico: # Percorre a linha recém-escrita, ainda no cache, em vez de misturar as somas ao laço do estêncil (que deixaria de ser vetorizado)
+                soma_p = soma_m = cos_p = sin_p = 0.0
+                max_p = max_m = -np.inf
+                j_max_p = j_max_m = 0
+                for j in range(N_y):
+                    p1 = pn1[i, j]
+                    m1 = mn1[i, j]
+                    soma_p += p1
+                    soma_m += m1
+                    cos_p += p1 * cos_y[j]
+                    sin_p += p1 * sin_y[j]
+                    if p1 > max_p:
+                        max_p = p1
+                        j_max_p = j
+                    if m1 > max_m:
+                        max_m = m1
+                        j_max_m = j
+
+                acumuladores[i, 0] = soma_p
+                acumuladores[i, 1] = soma_m
+                acumuladores[i, 2] = max_p
+                acumuladores[i, 3] = j_max_p
+                acumuladores[i, 4] = max_m
+                acumuladores[i, 5] = j_max_m
+                acumuladores[i, 6] = cos_p
+                acumuladores[i, 7] = sin_p
+
+def avisaForkDepoisDoNumba(): # Um fork depois de um kernel numba rodado com a camada TBB trava o processo principal na saída
+    if numba is None:
+        return
+    try:
+        camada = numba.threading_layer()
+    except ValueError: # Nenhum kernel paralelo rodou ainda: a camada nem foi escolhida
+        return
+    if camada == 'tbb':
+        warnings.warn("Criando processos depois de um kernel numba com a camada TBB: o processo pode travar na saída. "
+                      "Defina NUMBA_THREADING_LAYER=workqueue antes de importar o numba")
+
+def trabalhadorDominio(nomes_memoria, formato, dtype, linhas, coeficientes, fila, barreira_passo, barreira_fim, tempo_limite): # Processo que avança as linhas [i0, i1) da grade
+    memorias = [shared_memory.SharedMemory(name=nome) for nome in nomes_memoria]
+    p_buffers = [np.ndarray(formato, dtype=dtype, buffer=memorias[0].buf), np.ndarray(formato, dtype=dtype, buffer=memorias[1].buf)]
+    m_buffers = [np.ndarray(formato, dtype=dtype, buffer=memorias[2].buf), np.ndarray(formato, dtype=dtype, buffer=memorias[3].buf)]
+
+    N_x = formato[0]
+    i0, i1 = linhas
+    k1, k2, k3, lamb, v = coeficientes
+
+    # Faixa local com uma linha (plano em 3D) de halo de cada lado; as linhas de halo vêm dos vizinhos periódicos (i0 - 1) % N_x e i1 % N_x
+    formato_local = (i1 - i0 + 2,) + tuple(formato[1:])
+    p_local = np.empty(formato_local, dtype=dtype)
+    m_local = np.empty(formato_local, dtype=dtype)
+    p_local1 = np.empty(formato_local, dtype=dtype)
+    m_local1 = np.empty(formato_local, dtype=dtype)
+    rascunho = alocaRascunho(formato_local, dtype)
+
+    atual = 0
+    while True:
+        n = fila.get()
+        if n is None:
+            break
+
+        try:
+            for _ in range(n):
+                pn, mn = p_buffers[atual], m_buffers[atual]
+
+                # Troca de halo: lê as linhas vizinhas do estado compartilhado
+                p_local[1:-1] = pn[i0:i1]
+                m_local[1:-1] = mn[i0:i1]
+                p_local[0], m_local[0] = pn[(i0 - 1) % N_x], mn[(i0 - 1) % N_x]
+                p_local[-1], m_local[-1] = pn[i1 % N_x], mn[i1 % N_x]
+
+                FTCSND(p_local, m_local, k1, k2, k3, lamb, v, p_local1, m_local1, rascunho) # Só as linhas internas são válidas
+
+                p_buffers[1 - atual][i0:i1] = p_local1[1:-1]
+                m_buffers[1 - atual][i0:i1] = m_local1[1:-1]
+
+                barreira_passo.wait(tempo_limite) # Ninguém começa o próximo passo antes de todas as faixas estarem escritas
+                atual = 1 - atual
+
+            barreira_fim.wait(tempo_limite * n) # Avisa o processo principal que os n passos terminaram
+        except threading.BrokenBarrierError: # Outro processo morreu ou o principal desistiu: não há como continuar
+            break
+
+    for memoria in memorias:
+        memoria.close()
+
+class DominioParalelo(): # Grade dividida em faixas ao longo de x, cada uma avançada por um processo, com os estados em memória compartilhada
+    TEMPO_LIMITE_PASSO = 600 # Segundos que um processo espera pelos outros em um passo antes de concluir que algum morreu
+
+    def __init__(self, parametros, processos = None):
+        formato = parametros.formato
+        dtype = parametros.dtype
+        processos = min(processos or os.cpu_count(), parametros.N_x)
+
+        # Registrado antes de criar qualquer recurso: se algo falhar no meio, o que já foi criado é liberado
+        self.memorias = []
+        self.filas = []
+        self.processos = []
+        self.finalizador = weakref.finalize(self, DominioParalelo.__libera, self.filas, self.processos, self.memorias)
+        try:
+            self.__inicia(parametros, formato, dtype, processos)
+        except BaseException:
+            self.p_buffers = self.m_buffers = None # Solta as visões dos buffers para que a memória possa ser fechada
+            self.finalizador()
+            raise
+
+    def __inicia(self, parametros, formato, dtype, processos):
+        # Dois buffers por campo (estado atual e próximo), alternados a cada passo
+        tamanho = int(np.prod(formato)) * dtype.itemsize
+        for _ in range(4):
+            self.memorias.append(shared_memory.SharedMemory(create=True, size=tamanho))
+        self.p_buffers = [np.ndarray(formato, dtype=dtype, buffer=self.memorias[0].buf), np.ndarray(formato, dtype=dtype, buffer=self.memorias[1].buf)]
+        self.m_buffers = [np.ndarray(formato, dtype=dtype, buffer=self.memorias[2].buf), np.ndarray(formato, dtype=dtype, buffer=self.memorias[3].buf)]
+        self.atual = 0
+
+        limites = np.linspace(0, parametros.N_x, processos + 1).astype(int)
+        coeficientes = (parametros.k1, parametros.k2, parametros.k3, parametros.lamb, parametros.v)
+        nomes_memoria = [memoria.name for memoria in self.memorias]
+
+        avisaForkDepoisDoNumba()
+        barreira_passo = multiprocessing.Barrier(processos)
+        self.barreira_fim = multiprocessing.Barrier(processos + 1)
+        for i in range(processos):
+            fila = multiprocessing.Queue()
+            processo = multiprocessing.Process(target=trabalhadorDominio, daemon=True,
+                                               args=(nomes_memoria, formato, dtype, (limites[i], limites[i + 1]), coeficientes, fila,
+                                                     barreira_passo, self.barreira_fim, self.TEMPO_LIMITE_PASSO))
+            self.filas.append(fila)
+            processo.start()
+            self.processos.append(processo)
+
+    def setEstado(self, populacao, dinheiro):
+        self.p_buffers[self.atual][:] = populacao
+        self.m_buffers[self.atual][:] = dinheiro
+
+    def getEstado(self): # Views dos buffers compartilhados com o estado atual
+        return self.p_buffers[self.atual], self.m_buffers[self.atual]
+
+    def executa(self, n): # Avança n passos em todos os processos e espera terminarem; RuntimeError se algum processo morreu
+        self.__verificaProcessos()
+        for fila in self.filas:
+            fila.put(n)
+        try:
+            self.barreira_fim.wait(self.TEMPO_LIMITE_PASSO * n)
+        except threading.BrokenBarrierError:
+            self.__verificaProcessos()
+            raise RuntimeError(f"Os processos do método 'paralelo' não terminaram {n} passos em {self.TEMPO_LIMITE_PASSO * n} s")
+        self.atual = (self.atual + n) % 2
+
+    def __verificaProcessos(self):
+        mortos = [processo.exitcode for processo in self.processos if not processo.is_alive()]
+        if mortos:
+            raise RuntimeError(f"{len(mortos)} processo(s) do método 'paralelo' terminaram (códigos de saída {mortos}); o estado compartilhado não é mais válido")
+
+    def fecha(self):
+        self.p_buffers = None # Os buffers apontam para a memória compartilhada, que será fechada
+        self.m_buffers = None
+        self.finalizador()
+
+    @staticmethod
+    def __libera(filas, processos, memorias):
+        for fila in filas:
+            fila.put(None)
+        for processo in processos:
+            processo.join(timeout=5)
+        for memoria in memorias:
+            memoria.close()
+            memoria.unlink()
+
+class DominioEsparso(): # Grade dividida em ladrilhos; a cada passo só os ladrilhos ativos (algum |valor| acima do limiar) e os vizinhos deles são avançados
+    FRACAO_DENSA = 0.5 # Com mais que essa fração dos ladrilhos a avançar, o passo denso sai mais barato que juntar e espalhar os ladrilhos
+    INTERVALO_DENSO = 32 # Passos densos seguidos antes de varrer a grade de novo para ver se ela voltou a ficar esparsa
+
+    def __init__(self, parametros, ladrilho = 32, limiar = 0.0):
+        formato = parametros.formato
+        self.dimensao = parametros.dimensao
+        self.ladrilho = tuple(min(ladrilho, N) for N in formato) # Pontos por eixo de cada ladrilho
+        self.formato_ladrilhos = tuple(-(-N // T) for N, T in zip(formato, self.ladrilho)) # O último ladrilho de um eixo pode passar da borda: os índices dão a volta
+        self.limiar = limiar # Com 0, só ladrilhos exatamente nulos ficam parados e o resultado é idêntico ao do passo denso
+
+        # Índices de cada ladrilho em cada eixo, com uma linha de halo de cada lado e o contorno periódico: (ladrilhos no eixo, T + 2)
+        self.indices = [(np.arange(n)[:, None] * T + np.arange(-1, T + 1)[None, :]) % N
+                        for N, T, n in zip(formato, self.ladrilho, self.formato_ladrilhos)]
+        self.ativos = np.zeros(self.formato_ladrilhos, dtype=bool)
+        self.densos_restantes = 0 # Passos densos que ainda faltam antes da próxima varredura; enquanto for > 0, self.ativos está desatualizado
+
+    def atualizaAtivos(self, populacao, dinheiro): # Recalcula os ladrilhos ativos varrendo a grade inteira (estado inicial e depois de uma série de passos densos)
+        self.densos_restantes = 0
+        amplitude = np.maximum(np.abs(populacao), np.abs(dinheiro))
+        for eixo, T in enumerate(self.ladrilho):
+            amplitude = np.maximum.reduceat(amplitude, np.arange(0, amplitude.shape[eixo], T), axis = eixo)
+        self.ativos = ~(amplitude <= self.limiar) # NaN conta como ativo, como no passo denso
+
+    def ladrilhosAvancados(self): # Índices (n, d) dos ladrilhos ativos e dos seus vizinhos de face: a massa anda no máximo um ponto por passo
+        avancados = self.ativos.copy()
+        for eixo in range(self.dimensao):
+            avancados |= np.roll(self.ativos, 1, axis = eixo) | np.roll(self.ativos, -1, axis = eixo)
+        return np.argwhere(avancados)
+
+    def fracao(self, ladrilhos): # Fração dos ladrilhos da grade
+        return len(ladrilhos) / self.ativos.size
+
+    def __indicesBloco(self, ladrilhos, interior = False): # Índices para indexar a grade com todos os ladrilhos de uma vez: (n, T_0 + 2, T_1 + 2, ...) por broadcast
+        indices = []
+        for eixo in range(self.dimensao):
+            indice = self.indices[eixo][ladrilhos[:, eixo]]
+            if interior:
+                indice = indice[:, 1:-1]
+            forma = [len(ladrilhos)] + [1] * self.dimensao
+            forma[eixo + 1] = indice.shape[1]
+            indices.append(indice.reshape(forma))
+        return tuple(indices)
+
+    def passo(self, pn, mn, ladrilhos, coeficientes): # Avança, no lugar, só os ladrilhos dados; os blocos com halo são copiados antes, então escrever em pn/mn é seguro
+        k1, k2, k3, lamb, v = coeficientes
+        bloco = self.__indicesBloco(ladrilhos)
+        p_bloco, m_bloco = pn[bloco], mn[bloco]
+
+        # Os ladrilhos viram membros independentes de um lote (como no KellerSegelEnsemble); só o interior de cada bloco é válido
+        p_bloco1, m_bloco1 = FTCSND(p_bloco, m_bloco, k1, k2, k3, lamb, v, dimensao = self.dimensao)
+        interior = (slice(None),) + (slice(1, -1),) * self.dimensao
+        p_bloco1, m_bloco1 = p_bloco1[interior], m_bloco1[interior]
+
+        bloco = self.__indicesBloco(ladrilhos, interior = True)
+        pn[bloco] = p_bloco1
+        mn[bloco] = m_bloco1
+
+        eixos = tuple(range(1, self.dimensao + 1))
+        amplitude = np.maximum(np.abs(p_bloco1).max(axis = eixos), np.abs(m_bloco1).max(axis = eixos))
+        self.ativos[tuple(ladrilhos.T)] = ~(amplitude <= self.limiar)
+
 class KellerSegelModel():
-    def __init__(self, parametros):
-        self.parametros = parametros
+    METODOS = ('vetorizado', 'escalar', 'imex', 'espectral', 'numba', 'paralelo', 'esparso') # 'vetorizado' é o padrão; 'escalar' é o laço original, mantido como referência; 'imex' é semi-implícito; 'espectral' avança o dinheiro exatamente por FFT; 'numba' usa o kernel compilado; 'paralelo' divide a grade entre processos; 'esparso' só avança os ladrilhos com massa
+
+    def __init__(self, parametros, metodo = 'vetorizado', processos = None, perfilador = None, diagnosticos = None, ladrilho = 32, limiar = 0.0):
+        if metodo not in self.METODOS:
+            raise ValueError(f"Método desconhecido: {metodo}. Use um de {self.METODOS}")
+        if metodo == 'numba' and numba is None:
+            warnings.warn("numba não está instalado; usando o método 'vetorizado'")
+            metodo = 'vetorizado'
+        if metodo == 'numba' and parametros.dimensao != 2:
+            warnings.warn("O kernel numba é só 2D; usando o método 'vetorizado'")
+            metodo = 'vetorizado'
+        if metodo == 'escalar' and parametros.dimensao != 2:
+            raise ValueError("O método 'escalar' é a referência 2D; use 'vetorizado' em grades 1D e 3D")
 
-        self.zeros = np.matrix(np.zeros((parametros.N_x, parametros.N_y)))
+        self.parametros = parametros
+        self.metodo = metodo
+        self.processos = processos # Número de processos do método 'paralelo' (padrão: todos os núcleos)
+        self.dominio = None
+        self.esparso = DominioEsparso(parametros, ladrilho, limiar) if metodo == 'esparso' else None # Ladrilhos de 'ladrilho' pontos por eixo; ver DominioEsparso
+        self.perfilador = perfilador # Perfilador opcional: mede as fases 'passo', 'verificacao', 'callback', 'contagem' e 'diagnostico'
+        self.diagnosticos = diagnosticos # Diagnosticos opcional: registrado a cada diagnosticos.intervalo passos (no método 'numba', dentro do próprio kernel)
+        self.acumula_diagnostico = False # Pede ao kernel numba as medidas do passo em andamento
+
+        self.zeros = np.zeros(parametros.formato, dtype=parametros.dtype)
+
+        if metodo == 'imex':
+            # Difusão e decaimento implícitos (Euler para trás) resolvidos por FFT: (1 - k1 L) p^{n+1} = ..., (1 + lamb - k3 L) m^{n+1} = ...
+            simbolo = simboloLaplacianoND(parametros.formato)
+            self.denominador_populacao = 1 - parametros.k1 * simbolo
+            self.denominador_dinheiro = 1 + parametros.lamb - parametros.k3 * simbolo
+        elif metodo == 'espectral':
+            self.propagador_dinheiro, self.fonte_dinheiro = simboloDinheiroEspectral(parametros.formato, parametros.k3, parametros.lamb)
+
+        # Evolução exata do dinheiro total em um passo, M^{n+1} = a M^n + b P^n (a população total não muda); os diagnósticos medem a deriva em relação a ela
+        lamb = parametros.lamb
+        if metodo == 'imex':
+            self.mapa_dinheiro = (1 / (1 + lamb), parametros.v / (1 + lamb))
+        elif metodo == 'espectral':
+            self.mapa_dinheiro = (np.exp(-lamb), parametros.v * (-np.expm1(-lamb) / lamb if lamb > 0 else 1))
+        else:
+            self.mapa_dinheiro = (1 - lamb, parametros.v)
 
         self.tempo = 0
+        self.passos = 0 # Passos dados desde o estado inicial (guardado nos checkpoints)
+        self.historico_dt = [] # Pares (tempo, dt) aceitos pelo passo adaptativo
+        self.historico_erro = [] # Pares (tempo, erro) das verificações de atualizaAteConvergir, acumulados entre chamadas
 
-    def contagemPopulacao(self):
-        return self.estado_populacao.sum()
+    def contagemPopulacao(self): # Se os diagnósticos registraram o passo atual, devolve o total medido, sem somar a grade de novo
+        registro = self.diagnosticos.ultimo(self.passos) if self.diagnosticos is not None else None
+        if registro is not None:
+            return registro['populacao']
+        with medeFase(self.perfilador, 'contagem'):
+            return self.estado_populacao.sum()
 
     def contagemDinheiro(self):
-        return self.estado_dinheiro.sum()
-
-    def setEstadoInicial(self, matriz_populacao, matriz_dinheiro):
-        self.estado_populacao = np.matrix(matriz_populacao)
-        self.estado_dinheiro = np.matrix(matriz_dinheiro)
-
-    def getEstado(self):
+        registro = self.diagnosticos.ultimo(self.passos) if self.diagnosticos is not None else None
+        if registro is not None:
+            return registro['dinheiro']
+        with medeFase(self.perfilador, 'contagem'):
+            return self.estado_dinheiro.sum()
+
+    def registraDiagnosticos(self, acumuladores = None, referencia = False): # Registra o estado atual nos diagnósticos (com acumuladores, a partir das somas feitas pelo kernel numba)
+        with medeFase(self.perfilador, 'diagnostico'):
+            medidas = medidasAcumuladas(acumuladores) if acumuladores is not None else medidasND(self.estado_populacao, self.estado_dinheiro)
+            p = self.parametros
+            self.diagnosticos.registra(self.passos, self.tempo, medidas, p.formato, p.ds, self.mapa_dinheiro, referencia)
+
+    def __registraAntesDoPasso(self): # Devolve True se o próximo passo deve ser registrado; na primeira vez registra o estado inicial (ou restaurado), referência da deriva
+        if self.diagnosticos is None:
+            return False
+        if not self.diagnosticos.serie['passo']:
+            self.registraDiagnosticos()
+        return (self.passos + 1) % self.diagnosticos.intervalo == 0
+
+    def setEstadoInicial(self, matriz_populacao, matriz_dinheiro): # Os estados são guardados como ndarrays C-contíguos no dtype dos parâmetros
+        dtype = self.parametros.dtype
+        formato = self.parametros.formato
+
+        self.estado_populacao = np.array(matriz_populacao, dtype=dtype, order='C')
+        self.estado_dinheiro = np.array(matriz_dinheiro, dtype=dtype, order='C')
+
+        # Buffers reserva: os métodos 'vetorizado' e 'numba' escrevem o próximo estado neles e trocam com o estado atual a cada passo
+        self.reserva_populacao = np.empty(formato, dtype=dtype)
+        self.reserva_dinheiro = np.empty(formato, dtype=dtype)
+        self.rascunho = alocaRascunho(formato, dtype)
+
+        if self.metodo == 'numba':
+            self.acumuladores = np.empty((formato[0], ACUMULADORES)) # Medidas dos diagnósticos por linha, escritas pelo kernel
+            self.sem_acumuladores = np.empty((0, ACUMULADORES))
+        if self.diagnosticos is not None:
+            self.diagnosticos.limpa() # Novo estado inicial, nova série
+        if self.esparso is not None:
+            self.esparso.atualizaAtivos(self.estado_populacao, self.estado_dinheiro)
+
+        if self.metodo == 'paralelo':
+            if self.dominio is None:
+                self.dominio = DominioParalelo(self.parametros, self.processos)
+            self.dominio.setEstado(self.estado_populacao, self.estado_dinheiro)
+            self.estado_populacao, self.estado_dinheiro = self.dominio.getEstado()
+
+    def getEstado(self, copia = True): # Com copia = False devolve os próprios buffers do modelo, que serão sobrescritos nos próximos passos
+        if copia:
+            return (self.estado_populacao.copy(), self.estado_dinheiro.copy(), self.tempo)
         return (self.estado_populacao, self.estado_dinheiro, self.tempo)
 
-    def atualizaEstado(self):
+    def __atualizaEstadoEscalar(self): # FTCS célula a célula (referência para testes de regressão)
         # Pega o estado atual da população e dinheiro
         pn = self.estado_populacao
         mn = self.estado_dinheiro
@@ -102,28 +915,466 @@ class KellerSegelModel():
 
                 mn1[(i, j)] = mn[(i, j)] * (1 - 4 * k3 - lamb) + k3 * (mn[(i_previous, j)] + mn[(i, j_previous)] + mn[(i_next, j)] + mn[(i, j_next)]) + v * pn[(i, j)]
 
-        self.estado_populacao = pn1 # Atualiza o estado da população
-        self.estado_dinheiro = mn1 # Atualiza o estado do dinheiro
+        return pn1, mn1
+
+    def __atualizaEstadoVetorizado(self, pn, mn, pn1, mn1): # FTCS sobre a grade inteira, usando vizinhos deslocados com contorno periódico
+        p = self.parametros
+        FTCSND(pn, mn, p.k1, p.k2, p.k3, p.lamb, p.v, pn1, mn1, self.rascunho)
+
+    def __atualizaEstadoIMEX(self): # Difusão e decaimento implícitos, quimiotaxia explícita; dt deixa de ser limitado por k1, k3 <= 1/4
+        pn = self.estado_populacao
+        mn = self.estado_dinheiro
+
+        p = self.parametros
+
+        lado_direito_p = pn - p.k2 * termoQuimiotaxiaND(pn, mn)
+        lado_direito_m = mn + p.v * pn
+
+        pn1 = np.fft.irfftn(np.fft.rfftn(lado_direito_p) / self.denominador_populacao, s=p.formato)
+        mn1 = np.fft.irfftn(np.fft.rfftn(lado_direito_m) / self.denominador_dinheiro, s=p.formato)
+
+        return pn1.astype(p.dtype, copy=False), mn1.astype(p.dtype, copy=False)
+
+    def __atualizaEstadoEspectral(self): # Dinheiro avançado exatamente no espaço de Fourier; só o fluxo da população fica no espaço real
+        pn = self.estado_populacao
+        mn = self.estado_dinheiro
+
+        p = self.parametros
+
+        pn1 = pn + p.k1 * laplacianoND(pn) - p.k2 * termoQuimiotaxiaND(pn, mn)
+
+        # m^{n+1} = e^{dt A} m^n + (e^{dt A} - 1) / (dt A) * v p^n, com A = D_m L / ds² - beta
+        mn1 = np.fft.irfftn(self.propagador_dinheiro * np.fft.rfftn(mn) + self.fonte_dinheiro * (p.v * np.fft.rfftn(pn)), s=p.formato)
+
+        return pn1, mn1.astype(p.dtype, copy=False)
+
+    def __atualizaEstadoNumba(self, pn, mn, pn1, mn1): # Kernel compilado: sem arrays temporários, uma passada por grade
+        p = self.parametros
+        escalar = p.dtype.type # Coeficientes no mesmo dtype dos estados, para o kernel não misturar float32 e float64
+        acumuladores = self.acumuladores if self.acumula_diagnostico else self.sem_acumuladores # Os diagnósticos deste passo saem do próprio kernel
+        FTCS2DNumba(pn, mn, escalar(1 - 4 * p.k1), escalar(p.k1), escalar(p.k2), escalar(1 - 4 * p.k3 - p.lamb), escalar(p.k3), escalar(p.v),
+                    pn1, mn1, acumuladores, *fasesPeriodicas(p.N_y))
+
+    def __atualizaEstadoEsparso(self): # Só os ladrilhos com massa e seus vizinhos; quando eles já são boa parte da grade, um passo denso
+        esparso = self.esparso
+        if esparso.densos_restantes > 0: # Grade saturada: passos densos sem varrê-la, até a próxima verificação
+            self.__atualizaEstadoDuploBuffer(self.__atualizaEstadoVetorizado)
+            esparso.densos_restantes -= 1
+            if esparso.densos_restantes == 0:
+                esparso.atualizaAtivos(self.estado_populacao, self.estado_dinheiro)
+            return
+
+        ladrilhos = esparso.ladrilhosAvancados()
+        if esparso.fracao(ladrilhos) > esparso.FRACAO_DENSA:
+            self.__atualizaEstadoDuploBuffer(self.__atualizaEstadoVetorizado)
+            esparso.densos_restantes = esparso.INTERVALO_DENSO - 1 # Este passo conta como o primeiro da série
+            if esparso.densos_restantes == 0:
+                esparso.atualizaAtivos(self.estado_populacao, self.estado_dinheiro)
+        elif len(ladrilhos):
+            p = self.parametros
+            esparso.passo(self.estado_populacao, self.estado_dinheiro, ladrilhos, (p.k1, p.k2, p.k3, p.lamb, p.v))
+
+    def __atualizaEstadoDuploBuffer(self, passo): # Escreve o próximo estado nos buffers reserva e troca-os com o estado atual, sem alocar memória
+        pn = self.estado_populacao
+        mn = self.estado_dinheiro
+        pn1 = self.reserva_populacao
+        mn1 = self.reserva_dinheiro
+
+        passo(pn, mn, pn1, mn1)
+
+        self.reserva_populacao, self.reserva_dinheiro = pn, mn # O estado antigo vira a reserva do próximo passo
+        self.estado_populacao = pn1
+        self.estado_dinheiro = mn1
+
+    def atualizaEstado(self):
+        if self.metodo == 'paralelo':
+            return self.atualizaEstadoMultiplasVezes(n = 1)
+
+        registra = self.__registraAntesDoPasso()
+
+        with medeFase(self.perfilador, 'passo'):
+            if self.metodo == 'vetorizado':
+                self.__atualizaEstadoDuploBuffer(self.__atualizaEstadoVetorizado)
+            elif self.metodo == 'numba':
+                self.acumula_diagnostico = registra
+                self.__atualizaEstadoDuploBuffer(self.__atualizaEstadoNumba)
+            elif self.metodo == 'esparso':
+                self.__atualizaEstadoEsparso()
+            else:
+                if self.metodo == 'escalar':
+                    pn1, mn1 = self.__atualizaEstadoEscalar()
+                elif self.metodo == 'imex':
+                    pn1, mn1 = self.__atualizaEstadoIMEX()
+                elif self.metodo == 'espectral':
+                    pn1, mn1 = self.__atualizaEstadoEspectral()
+
+                self.estado_populacao = pn1 # Atualiza o estado da população
+                self.estado_dinheiro = mn1 # Atualiza o estado do dinheiro
+
         self.tempo += self.parametros.dt # Atualiza o tempo decorrido no modelo
+        self.passos += 1
+
+        if registra:
+            self.registraDiagnosticos(self.acumuladores if self.metodo == 'numba' else None)
+
+    def atualizaEstadoMultiplasVezes(self, n = 1):
+        if self.metodo == 'paralelo': # Os n passos são feitos pelos processos de uma vez, sem voltar ao processo principal a cada passo
+            while n > 0:
+                k = n
+                if self.diagnosticos is not None: # Com diagnósticos, os processos param em cada passo a registrar
+                    self.__registraAntesDoPasso()
+                    k = min(n, self.diagnosticos.intervalo - self.passos % self.diagnosticos.intervalo)
+                with medeFase(self.perfilador, 'passos_paralelo'): # Uma medida para os k passos
+                    self.dominio.executa(k)
+                self.estado_populacao, self.estado_dinheiro = self.dominio.getEstado()
+                for _ in range(0, k):
+                    self.tempo += self.parametros.dt
+                self.passos += k
+                n -= k
+                if self.diagnosticos is not None and self.passos % self.diagnosticos.intervalo == 0:
+                    self.registraDiagnosticos()
+            return
+
+        for _ in range(0, n):
+            self.atualizaEstado()
+
+    NORMAS = ('inf', 'l2', 'relativa')
+
+    def __estadoAnterior(self): # Estado antes do último passo, quando ele ainda está em um buffer do modelo (sem cópia); None caso contrário
+        if self.metodo in ('vetorizado', 'numba'):
+            return self.reserva_populacao, self.reserva_dinheiro
+        if self.metodo == 'paralelo':
+            return self.dominio.p_buffers[1 - self.dominio.atual], self.dominio.m_buffers[1 - self.dominio.atual]
+        return None
+
+    def __normaDiferenca(self, atual, anterior, norma): # Norma de (atual - anterior), usando o rascunho para não alocar
+        diferenca = np.subtract(atual, anterior, out=self.rascunho['a'])
+        if norma == 'l2':
+            return float(np.sqrt(np.vdot(diferenca, diferenca) * self.parametros.ds ** self.parametros.dimensao)) # Norma L2 discreta (volume da célula ds^d)
+
+        maximo = float(np.abs(diferenca, out=diferenca).max())
+        if norma == 'relativa':
+            return maximo / max(float(atual.max()), -float(atual.min()), 1e-300)
+        return maximo
+
+    def atualizaAteConvergir(self, epsilon = 1e-6, norma = 'inf', campos = ('populacao', 'dinheiro'), intervalo = 10,
+                             residuo = False, max_passos = None, callback = None): # Avança até o estado estacionário; devolve True se convergiu
+        # A cada 'intervalo' passos compara o estado com o da verificação anterior (ou, com residuo = True, só a variação
+        # do último passo dividida por dt, lida do buffer reserva sem guardar cópia). O erro é o maior entre os campos.
+        if norma not in self.NORMAS:
+            raise ValueError(f"Norma desconhecida: {norma}. Use uma de {self.NORMAS}")
+
+        indices = [('populacao', 'dinheiro').index(campo) for campo in campos]
+        # As verificações são acrescentadas a self.historico_erro, que continua o histórico restaurado de um checkpoint
+
+        passos = 0
+        anterior = None
+        while max_passos is None or passos < max_passos:
+            if residuo:
+                self.atualizaEstadoMultiplasVezes(n = intervalo - 1)
+                copia_anterior = None if self.__estadoAnterior() is not None else self.getEstado()[:2]
+                self.atualizaEstadoMultiplasVezes(n = 1)
+                anterior = copia_anterior or self.__estadoAnterior()
+                escala = 1 / self.parametros.dt
+            else:
+                if anterior is None:
+                    anterior = self.getEstado()[:2]
+                self.atualizaEstadoMultiplasVezes(n = intervalo)
+                escala = 1
+            passos += intervalo
+
+            with medeFase(self.perfilador, 'verificacao'):
+                atual = self.getEstado(copia = False)[:2]
+                erro = max(self.__normaDiferenca(atual[i], anterior[i], norma) for i in indices) * escala
+                self.historico_erro.append((self.tempo, erro))
+
+                if not residuo: # Guarda o estado desta verificação para a próxima, reaproveitando as cópias
+                    for i in (0, 1):
+                        anterior[i][...] = atual[i]
+
+            if not np.isfinite(erro): # O estado divergiu (ex.: dt acima de dtMaximoEstavel()); continuar não chegaria a lugar nenhum
+                warnings.warn(f"atualizaAteConvergir: o erro deixou de ser finito em t = {self.tempo}; a simulação divergiu")
+                return False
+
+            if callback is not None:
+                with medeFase(self.perfilador, 'callback'):
+                    callback(self, erro)
+
+            if erro < epsilon:
+                return True
+
+        return False
+
+    def fecha(self): # Encerra os processos e libera a memória compartilhada do método 'paralelo'
+        if self.dominio is not None:
+            # O estado passa a ser uma cópia local; views obtidas com getEstado(copia = False) deixam de ser válidas
+            self.estado_populacao = self.estado_populacao.copy()
+            self.estado_dinheiro = self.estado_dinheiro.copy()
+            self.dominio.fecha()
+            self.dominio = None
+
+    def resolveEstacionario(self, tolerancia = 1e-9, niveis = 0, max_iteracoes = 200, tau_inicial = None): # Vai direto ao estado estacionário a partir do estado atual; devolve (populacao, dinheiro, historico_residuo)
+        # Continuação pseudo-transiente: passos de Euler implícito (I/tau - J) delta = R(u), resolvidos por Newton-Krylov (GMRES), com tau
+        # crescendo à medida que o resíduo cai (tau *= r_anterior / r). No início isso acompanha a dinâmica, e chega ao mesmo estado que a
+        # marcha no tempo. Com tau grande vira o método de Newton, que converge em poucas iterações. O precondicionador resolve a parte
+        # linear (difusão e decaimento) exatamente por FFT, que na grade periódica faz o papel do multigrid. Com niveis > 0 o estado é
+        # resolvido antes em grades 2, 4, ... 2^niveis vezes mais grossas (médias em blocos), e cada solução serve de chute para a grade seguinte.
+        # O resíduo é max(|∂p/∂t|, |∂m/∂t|), o mesmo de atualizaAteConvergir(residuo = True, norma = 'inf'); o estado do modelo passa a ser a solução.
+        p = self.parametros
+        fator = 2 ** niveis
+        if any(N % fator for N in p.formato):
+            raise ValueError(f"Com niveis = {niveis} a grade {p.formato} precisa ser divisível por {fator} em cada eixo")
+
+        populacao = reduzResolucao(np.asarray(self.estado_populacao, dtype=np.float64), fator)
+        dinheiro = reduzResolucao(np.asarray(self.estado_dinheiro, dtype=np.float64), fator)
+        tau = tau_inicial or p.dt
+        self.historico_residuo = [] # Pares (nível, resíduo) de cada iteração aceita; nível 0 é a grade do modelo
+
+        for nivel in range(niveis, -1, -1):
+            if nivel < niveis: # Prolonga a solução da grade mais grossa repetindo cada ponto
+                for eixo in range(p.dimensao):
+                    populacao = np.repeat(populacao, 2, axis = eixo)
+                    dinheiro = np.repeat(dinheiro, 2, axis = eixo)
+            with medeFase(self.perfilador, 'estacionario'):
+                populacao, dinheiro, tau = self.__continuacaoPseudoTransiente(populacao, dinheiro, p.ds * 2 ** nivel, tau, nivel,
+                                                                              tolerancia if nivel == 0 else 1e3 * tolerancia, max_iteracoes)
+
+        if not self.historico_residuo[-1][1] < tolerancia:
+            warnings.warn(f"resolveEstacionario não convergiu em {max_iteracoes} iterações: resíduo {self.historico_residuo[-1][1]:.3e}")
+
+        self.setEstadoInicial(populacao, dinheiro)
+        return self.getEstado()[:2] + (self.historico_residuo,)
+
+    def __continuacaoPseudoTransiente(self, populacao, dinheiro, ds, tau, nivel, tolerancia, max_iteracoes): # Iterações de resolveEstacionario em uma grade com espaçamento ds
+        p = self.parametros
+        coeficientes = (p.D_p, p.D_m, p.gamma, p.alfa, p.beta, ds)
+        simbolo = simboloLaplacianoND(populacao.shape) / ds ** 2
+        formato = populacao.shape
+
+        u = np.stack((populacao, dinheiro))
+        R = np.stack(residuoEstacionarioND(u[0], u[1], *coeficientes))
+        r = float(np.abs(R).max())
+        self.historico_residuo.append((nivel, r))
+
+        def aplica(v): # (I/tau - J) v, com o jacobiano exato (a quimiotaxia é bilinear em p e m)
+            Jp = (p.D_p * laplacianoND(v[0]) - p.gamma * (termoQuimiotaxiaND(v[0], u[1]) + termoQuimiotaxiaND(u[0], v[1]))) / ds ** 2
+            Jm = p.D_m * laplacianoND(v[1]) / ds ** 2 - p.beta * v[1] + p.alfa * v[0]
+            return v / tau - np.stack((Jp, Jm))
+
+        def precondiciona(v): # Inversa de (I/tau - difusão + decaimento), campo a campo, por FFT
+            return np.stack((np.fft.irfftn(np.fft.rfftn(v[0]) / (1 / tau - p.D_p * simbolo), s=formato),
+                             np.fft.irfftn(np.fft.rfftn(v[1]) / (1 / tau + p.beta - p.D_m * simbolo), s=formato)))
+
+        for _ in range(max_iteracoes):
+            if r < tolerancia:
+                break
+
+            delta = resolveGMRES(aplica, R, precondiciona)
+            delta[0] -= delta[0].mean() # A solução exata não muda a população total; com tau grande o modo constante só acumularia arredondamento
+            u_novo = u + delta
+            R_novo = np.stack(residuoEstacionarioND(u_novo[0], u_novo[1], *coeficientes))
+            r_novo = float(np.abs(R_novo).max())
+
+            if not np.isfinite(r_novo) or r_novo > 10 * r: # Passo grande demais: tenta de novo com tau menor
+                tau /= 4
+                continue
+
+            tau = min(tau * max(r / r_novo, 0.5), 1e15) # Um resíduo que cai permite passos maiores, e um que sobe pede passos menores
+            u, R, r = u_novo, R_novo, r_novo
+            self.historico_residuo.append((nivel, r))
+
+        return u[0], u[1], tau
+
+    def dtMaximoEstavel(self): # Maior dt para o qual o FTCS explícito é estável: 2d k1 <= 1 e 2d k3 + lamb <= 1 (d = dimensão da grade)
+        p = self.parametros
+        vizinhos = 2 * p.dimensao
+        return min(p.ds ** 2 / (vizinhos * p.D_p), 1 / (vizinhos * p.D_m / p.ds ** 2 + p.beta))
+
+    def __passoFTCS(self, pn, mn, dt): # Um passo do FTCS com um dt arbitrário (os k's dos parâmetros valem só para parametros.dt)
+        p = self.parametros
+        k1 = p.D_p * dt / (p.ds ** 2)
+        return FTCSND(pn, mn, k1, p.gamma * k1 / p.D_p, p.D_m * dt / (p.ds ** 2), p.beta * dt, p.alfa * dt)
+
+    def __passoIMEX(self, pn, mn, dt): # Um passo do IMEX com um dt arbitrário: difusão e decaimento implícitos, então dt não é limitado por k1, k3 <= 1/4
+        p = self.parametros
+        simbolo = simboloLaplacianoND(p.formato)
+        k3 = p.D_m * dt / (p.ds ** 2)
+
+        lado_direito_p = pn - (p.gamma * dt / (p.ds ** 2)) * termoQuimiotaxiaND(pn, mn)
+        lado_direito_m = mn + (p.alfa * dt) * pn
+
+        pn1 = np.fft.irfftn(np.fft.rfftn(lado_direito_p) / (1 - (p.D_p * dt / (p.ds ** 2)) * simbolo), s=p.formato)
+        mn1 = np.fft.irfftn(np.fft.rfftn(lado_direito_m) / (1 + p.beta * dt - k3 * simbolo), s=p.formato)
+
+        return pn1.astype(p.dtype, copy=False), mn1.astype(p.dtype, copy=False)
+
+    INTEGRADORES_ADAPTATIVOS = ('imex', 'ftcs') # 'imex' não tem limite de estabilidade na difusão; 'ftcs' fica preso a dtMaximoEstavel()
+
+    def atualizaEstadoAdaptativo(self, t_final, tolerancia = 1e-4, dt_inicial = None, dt_minimo = None, integrador = 'imex',
+                                 dt_maximo = None): # Avança até t_final com dt adaptativo (passo dobrado sobre o IMEX ou o FTCS)
+        # Com 'imex', dt cresce até dt_maximo (padrão: sem limite) quando a solução fica suave, e é aí que o trabalho por segundo simulado cai;
+        # com 'ftcs', dt nunca passa de dtMaximoEstavel(), então cada passo aceito (3 avaliações) sai mais caro que um passo fixo no limite.
+        # RuntimeError se o erro deixar de ser finito ou se um passo for rejeitado com dt <= dt_minimo (padrão: 1e-6 dtMaximoEstavel());
+        # nos dois casos o modelo fica no último passo aceito
+        if integrador not in self.INTEGRADORES_ADAPTATIVOS:
+            raise ValueError(f"Integrador desconhecido: {integrador}. Use um de {self.INTEGRADORES_ADAPTATIVOS}")
+        passo = self.__passoIMEX if integrador == 'imex' else self.__passoFTCS
+
+        dt_estavel = self.dtMaximoEstavel()
+        if integrador == 'ftcs':
+            dt_max = dt_estavel if dt_maximo is None else min(dt_maximo, dt_estavel)
+        else:
+            dt_max = np.inf if dt_maximo is None else dt_maximo
+        dt = min(dt_inicial or self.parametros.dt, dt_max)
+        dt_minimo = dt_estavel * 1e-6 if dt_minimo is None else dt_minimo
+
+        pn = self.estado_populacao
+        mn = self.estado_dinheiro
+
+        try:
+            while self.tempo < t_final - 1e-12 * max(1, abs(t_final)):
+                dt = min(dt, t_final - self.tempo) # Não passa de t_final
+
+                # Um passo de dt contra dois de dt / 2; a diferença estima o erro local
+                with medeFase(self.perfilador, 'passo_adaptativo'):
+                    p_inteiro, m_inteiro = passo(pn, mn, dt)
+                    p_meio, m_meio = passo(pn, mn, dt / 2)
+                    p_meio, m_meio = passo(p_meio, m_meio, dt / 2)
+
+                    erro = float(max(np.abs(p_meio - p_inteiro).max() / max(np.abs(p_meio).max(), 1e-300),
+                                     np.abs(m_meio - m_inteiro).max() / max(np.abs(m_meio).max(), 1e-300)))
+
+                if not np.isfinite(erro): # NaN nunca é rejeitado nem aceito: o laço não terminaria
+                    raise RuntimeError(f"atualizaEstadoAdaptativo: o erro deixou de ser finito em t = {self.tempo} com dt = {dt}; a simulação divergiu")
+
+                if erro <= tolerancia: # Aceita o passo, ficando com a solução dos dois meios passos
+                    pn, mn = p_meio, m_meio
+                    self.tempo += dt
+                    self.passos += 1
+                    self.historico_dt.append((self.tempo, dt))
+                elif dt <= dt_minimo:
+                    raise RuntimeError(f"atualizaEstadoAdaptativo: erro {erro:.3g} acima da tolerância {tolerancia} com dt = {dt} <= dt_minimo = {dt_minimo} em t = {self.tempo}")
+
+                # Erro local dos dois esquemas (Euler) ~ dt², então o fator ótimo é (tolerancia / erro)^(1/2); limita o crescimento e a redução por passo
+                fator = 0.9 * (tolerancia / erro) ** 0.5 if erro > 0 else 5
+                dt = max(min(dt * min(5, max(0.2, fator)), dt_max), dt_minimo)
+        finally: # Mesmo interrompido, o modelo fica com o último estado aceito
+            self.estado_populacao = pn
+            self.estado_dinheiro = mn
+
+            if self.dominio is not None: # No método 'paralelo' o estado vive na memória compartilhada dos processos
+                self.dominio.setEstado(pn, mn)
+                self.estado_populacao, self.estado_dinheiro = self.dominio.getEstado()
+            if self.esparso is not None: # O estado foi trocado por inteiro
+                self.esparso.atualizaAtivos(pn, mn)
+            if self.diagnosticos is not None: # Os passos adaptativos não seguem o mapa de parametros.dt: o estado final vira a nova referência da deriva
+                self.registraDiagnosticos(referencia = True)
+
+class KellerSegelEnsemble(): # B simulações empilhadas em um único array (B, *formato), avançadas juntas a cada passo
+    def __init__(self, lista_parametros):
+        self.lista_parametros = list(lista_parametros)
+
+        formato = self.lista_parametros[0].formato
+        for parametros in self.lista_parametros:
+            if parametros.formato != formato:
+                raise ValueError("Todos os membros do ensemble devem ter a mesma grade")
+
+        self.dtype = self.lista_parametros[0].dtype # O ensemble usa o dtype do primeiro membro
+        self.B = len(self.lista_parametros) # Número de membros
+        self.formato = formato
+        self.dimensao = len(formato)
+
+        # Coeficientes por membro, no formato (B, 1, ..., 1) para fazer broadcast sobre a grade
+        self.k1 = self.__coeficiente('k1')
+        self.k2 = self.__coeficiente('k2')
+        self.k3 = self.__coeficiente('k3')
+        self.v = self.__coeficiente('v')
+        self.lamb = self.__coeficiente('lamb')
+
+        self.dt = np.array([parametros.dt for parametros in self.lista_parametros])
+        self.tempo = np.zeros(self.B) # Cada membro tem o seu dt, então o tempo decorrido é por membro
+
+    def __coeficiente(self, nome):
+        return np.array([getattr(parametros, nome) for parametros in self.lista_parametros], dtype=self.dtype).reshape((-1,) + (1,) * self.dimensao)
+
+    def setEstadoInicial(self, populacoes, dinheiros): # Aceita (B, *formato) ou uma única grade, replicada para todos os membros
+        formato = (self.B,) + self.formato
+        self.estado_populacao = np.broadcast_to(np.asarray(populacoes, dtype=self.dtype), formato).copy()
+        self.estado_dinheiro = np.broadcast_to(np.asarray(dinheiros, dtype=self.dtype), formato).copy()
+
+        self.reserva_populacao = np.empty(formato, dtype=self.dtype)
+        self.reserva_dinheiro = np.empty(formato, dtype=self.dtype)
+        self.rascunho = alocaRascunho(formato, self.dtype, self.dimensao)
+
+    def getEstado(self, copia = True): # Com copia = False devolve os próprios buffers, que serão sobrescritos nos próximos passos
+        if copia:
+            return (self.estado_populacao.copy(), self.estado_dinheiro.copy(), self.tempo.copy())
+        return (self.estado_populacao, self.estado_dinheiro, self.tempo)
+
+    def getEstadoMembro(self, b): # Mesmo formato de KellerSegelModel.getEstado, para o membro b
+        return (self.estado_populacao[b].copy(), self.estado_dinheiro[b].copy(), self.tempo[b])
+
+    def contagemPopulacao(self): # População total de cada membro
+        return self.estado_populacao.sum(axis=tuple(range(1, self.dimensao + 1)))
+
+    def contagemDinheiro(self): # Dinheiro total de cada membro
+        return self.estado_dinheiro.sum(axis=tuple(range(1, self.dimensao + 1)))
+
+    def atualizaEstado(self): # Escreve nos buffers reserva e troca, como no KellerSegelModel
+        FTCSND(self.estado_populacao, self.estado_dinheiro, self.k1, self.k2, self.k3, self.lamb, self.v,
+               self.reserva_populacao, self.reserva_dinheiro, self.rascunho, self.dimensao)
+        self.estado_populacao, self.reserva_populacao = self.reserva_populacao, self.estado_populacao
+        self.estado_dinheiro, self.reserva_dinheiro = self.reserva_dinheiro, self.estado_dinheiro
+        self.tempo += self.dt
 
     def atualizaEstadoMultiplasVezes(self, n = 1):
         for _ in range(0, n):
             self.atualizaEstado()
 
+def verificaPrecisaoDtype(parametros, matriz_populacao, matriz_dinheiro, n = 1000, metodo = 'vetorizado'): # Roda o mesmo caso em float32 e float64 e devolve o maior erro relativo de cada campo após n passos
+    estados = {}
+    for dtype in (np.float32, np.float64):
+        parametros_dtype = copy.copy(parametros)
+        parametros_dtype.dtype = np.dtype(dtype)
+
+        modelo = KellerSegelModel(parametros_dtype, metodo)
+        modelo.setEstadoInicial(matriz_populacao, matriz_dinheiro)
+        modelo.atualizaEstadoMultiplasVezes(n)
+        estados[dtype] = modelo.getEstado(copia = False)
+
+    (p32, m32, _), (p64, m64, _) = estados[np.float32], estados[np.float64]
+    return {
+        'populacao': float(np.abs(p32 - p64).max() / np.abs(p64).max()),
+        'dinheiro': float(np.abs(m32 - m64).max() / max(np.abs(m64).max(), 1e-300)),
+        'massa_populacao': float(abs(p32.sum(dtype=np.float64) - p64.sum()) / abs(p64.sum())),
+    }
+
 class AnimacaoTool():
-    def __init__(self, nome_gif):
+    def __init__(self, nome_gif, reutiliza_figura = False, perfilador = None, orcamento = None, reducao = 'media'):
+        if reducao not in REDUCOES:
+            raise ValueError(f"Redução desconhecida: {reducao}. Use uma de {REDUCOES}")
+
         self.nome_gif = nome_gif
-        self.temp_img_name = 'tmp.jpeg'
         self.images = []
+        self.perfilador = perfilador # Perfilador opcional: mede as fases 'plot', 'frame', 'checkpoint' e 'gif' (passe o mesmo ao modelo para ver a simulação junto)
+        self.orcamento = orcamento # Máximo de pontos por campo nos plots (polígonos da superfície, vértices do heat map); grades maiores são reduzidas antes do plot
+        self.reducao = reducao # 'media' ou 'maximo' (preserva os picos); ver reduzResolucao
+
+        self.reutiliza_figura = reutiliza_figura # Cria a figura e os artistas uma única vez e só atualiza os dados nos frames seguintes
+        self.figura = None
+        self.artistas = None
 
     def plotSuperficie(self, ax, x, y, z, cmap, title): # Método para fazer o plot da superfície
-        X, Y = np.meshgrid(x, y)
+        X, Y = malhaPlot(x, y)
         ax.set_title(title, fontsize = 15)
         ax.grid(False)
         plot = ax.plot_surface(X, Y, z, cmap=cmap, edgecolor='none', rstride=1, cstride=1, shade=True)
         return plot
 
     def __plotDuasSuperficies(self, x, y, populacao, dinheiro): # Método para fazer um plot para população e dinheiro separadamente
+        if self.reutiliza_figura:
+            return self.__atualizaDuasSuperficies(x, y, populacao, dinheiro)
+
         f = plt.figure(figsize=(10, 6))
         ax = f.add_subplot(1, 2, 1, projection = '3d')
         ax.set_xlabel('x')
@@ -137,8 +1388,32 @@ class AnimacaoTool():
         # ax.set_zlim((self.min_mon, self.max_mon))
         self.plotSuperficie(ax, x, y, dinheiro, 'winter', 'Dinheiro')
 
+    def __atualizaDuasSuperficies(self, x, y, populacao, dinheiro): # Reaproveita figura e eixos 3D; só a superfície é trocada (plot_surface não permite atualizar os dados)
+        if self.figura is None or self.artistas.get('tipo') != 'superficies':
+            self.fechaFigura()
+            self.figura = plt.figure(figsize=(10, 6))
+            eixos = []
+            for n in (1, 2):
+                ax = self.figura.add_subplot(1, 2, n, projection = '3d')
+                ax.set_xlabel('x')
+                ax.set_ylabel('y')
+                eixos.append(ax)
+            self.artistas = {'tipo': 'superficies', 'eixos': eixos, 'superficies': [None, None]}
+
+        configuracoes = ((populacao, 'cool', 'População'), (dinheiro, 'winter', 'Dinheiro'))
+        for n, (z, cmap, titulo) in enumerate(configuracoes):
+            if self.artistas['superficies'][n] is not None:
+                self.artistas['superficies'][n].remove()
+            self.artistas['superficies'][n] = self.plotSuperficie(self.artistas['eixos'][n], x, y, z, cmap, titulo)
+
+    def fechaFigura(self): # Fecha a figura reaproveitada entre frames, se houver
+        if self.figura is not None:
+            plt.close(self.figura)
+        self.figura = None
+        self.artistas = None
+
     def __plotUmaSuperficie(self, x, y, populacao, dinheiro): # Método para fazer um plot para população com o dinheiro sendo uma 4ª dimensão na forma de mapa de cor
-        X, Y = np.meshgrid(x, y)
+        X, Y = malhaPlot(x, y)
         fig = plt.figure()
         ax = plt.axes(projection='3d')
         ax.set_xlabel('x')
@@ -163,15 +1438,30 @@ class AnimacaoTool():
         return plot
 
     def plotEstadoModelo(self, x, y, populacao, dinheiro): # Método que seleciona o tipo de plot
-        self.__plotDuasSuperficies(x, y, populacao, dinheiro)
+        with medeFase(self.perfilador, 'plot'):
+            x, y, populacao, dinheiro = reduzParaRender(x, y, populacao, dinheiro, self.orcamento, self.reducao)
+            self.__plotDuasSuperficies(x, y, populacao, dinheiro)
         # self.__plotUmaSuperficie(x, y, populacao, dinheiro)
 
     def plotHeatMapEstadoModelo(self, x, y, populacao, dinheiro):
+        with medeFase(self.perfilador, 'plot'):
+            x, y, populacao, dinheiro = reduzParaRender(x, y, populacao, dinheiro, self.orcamento, self.reducao)
+            self.__plotHeatMap(x, y, populacao, dinheiro)
+
+    def __plotHeatMap(self, x, y, populacao, dinheiro):
         l_p, r_p  = populacao.min(), populacao.max()
-        l_m, r_m  = dinheiro.max(), dinheiro.max()
+        l_m, r_m  = dinheiro.min(), dinheiro.max()
 
-        
-        X, Y = np.meshgrid(x, y)
+        if self.reutiliza_figura and self.figura is not None and self.artistas.get('tipo') == 'heat_map':
+            # Só atualiza os dados e os limites de cor; as colorbars acompanham os mapeamentos
+            c_pop, c_mon = self.artistas['malhas']
+            c_pop.set_array(np.asarray(populacao))
+            c_pop.set_clim(l_p, r_p)
+            c_mon.set_array(np.asarray(dinheiro))
+            c_mon.set_clim(l_m, r_m)
+            return
+
+        X, Y = malhaPlot(x, y)
 
         figure, (ax_pop, ax_mon) = plt.subplots(1, 2, figsize=(15, 6))
         
@@ -185,64 +1475,82 @@ class AnimacaoTool():
         c_mon = ax_mon.pcolormesh(X, Y, dinheiro, shading='gouraud', cmap='viridis', vmin=l_m, vmax=r_m)
         figure.colorbar(c_mon, ax = ax_mon)
 
-    def __erro(self, pn, pn10): # Cálculo do erro
-        dif_p = pn - pn10
-        erro = dif_p.max()
-        return erro
-
-    def salvaFrame(self): # Salva o frame em uma lista
-        plt.savefig(self.temp_img_name)
-        plt.close()
-        self.images.append(imageio.imread(self.temp_img_name))
-        os.remove(self.temp_img_name)
-
-    def geraGifHeatMap(self, modelo, epsilon = 1e-6):
+        if self.reutiliza_figura:
+            self.fechaFigura()
+            self.figura = figure
+            self.artistas = {'tipo': 'heat_map', 'malhas': (c_pop, c_mon)}
+
+    def salvaFrame(self): # Salva o frame em uma lista, lendo direto do buffer do canvas (sem arquivo temporário)
+        with medeFase(self.perfilador, 'frame'):
+            if self.reutiliza_figura:
+                self.images.append(capturaFrame(self.figura)) # A figura continua aberta para o próximo frame
+            else:
+                self.images.append(capturaFrame(plt.gcf()))
+                plt.close()
+
+    def __guardaQuadro(self, checkpoint, modelo = None): # Com um CheckpointTool, grava o último frame no disco e, se for a hora, um checkpoint do modelo
+        if checkpoint is None:
+            return
+        with medeFase(self.perfilador, 'checkpoint'):
+            checkpoint.salvaQuadro(len(self.images) - 1, self.images[-1])
+            if modelo is not None:
+                checkpoint.verifica(modelo, extra = {'n_quadros': len(self.images)})
+
+    def __retomaCheckpoint(self, checkpoint, modelo): # Restaura o modelo e os frames do último checkpoint; devolve False se não havia checkpoint
+        extra = checkpoint.restaura(modelo) if checkpoint is not None else None
+        if extra is None:
+            return False
+        self.images = checkpoint.carregaQuadros(extra.get('n_quadros', 0))
+        print(f"Retomando do passo {modelo.passos} (t = {modelo.tempo}) com {len(self.images)} frames")
+        return True
+
+    def geraGifHeatMap(self, modelo, epsilon = 1e-6, norma = 'inf', campos = ('dinheiro',), checkpoint = None): # Com checkpoint (um CheckpointTool), retoma do último checkpoint e grava novos durante a simulação
         print(f"Iniciando processamento...")
         start = time.time() # Salva o tempo inicial de processamento do modelo
 
-        x = modelo.parametros.x
-        y = modelo.parametros.y
+        x, y = modelo.parametros.malha() # Malha construída uma vez, e não a cada frame
         populacao, dinheiro, _ = modelo.getEstado()
 
-        self.plotHeatMapEstadoModelo(x, y, populacao, dinheiro) # Plota o estado inicial
-        self.salvaFrame() # Salva o frame
-
-        erro = 999
+        if not self.__retomaCheckpoint(checkpoint, modelo):
+            self.plotHeatMapEstadoModelo(x, y, populacao, dinheiro) # Plota o estado inicial
+            self.salvaFrame() # Salva o frame
+            self.__guardaQuadro(checkpoint)
 
         print(f"População: {modelo.contagemPopulacao()}") # Esse trecho de código serve para acompanhar se a população está se mantendo fixa, em consonância com o modelo
         print(f"Dinheiro: {modelo.contagemDinheiro()}\n") # Mostra o dinheiro líquido inicial
 
-        while erro >= epsilon:
-            modelo.atualizaEstadoMultiplasVezes(n = 10) # Intera dez vezes o estado do modelo
-            p, d, _ = modelo.getEstado() # Pega os valores da população e dinheiro
+        def salvaVerificacao(modelo, erro): # Chamado pelo modelo a cada verificação de convergência (a cada 10 passos)
+            p, d, _ = modelo.getEstado(copia = False) # Pega os valores da população e dinheiro
 
             self.plotHeatMapEstadoModelo(x, y, p, d) # Plota o estado atual
             self.salvaFrame() # Salva o frame
-
-            erro = self.__erro(dinheiro, d) # Calcula o erro
-            dinheiro = d # atualiza a variável de comparação
+            self.__guardaQuadro(checkpoint, modelo)
 
             print(f"Erro atual: {erro}") # Mostra o erro para verificar se o modelo está convergindo
             print(f"População Atual: {modelo.contagemPopulacao()}") # Verifica a população
             print(f"Dinheiro Atual: {modelo.contagemDinheiro()}\n") # Mostra o dinheiro líquido
 
+        modelo.atualizaAteConvergir(epsilon, norma = norma, campos = campos, intervalo = 10, callback = salvaVerificacao)
+
+        self.fechaFigura()
+
         elapsed = time.time() - start # Calcula o tempo de processamento
         print(f"Fim do processamento: {elapsed}s")
 
         print(f"Iniciando render...")
         start = time.time() # Salva o tempo inicial de render
 
-        imageio.mimsave(f'{self.nome_gif}.gif', self.images, fps=15) # Gera um gif com as imagens geradas. Deve-se tomar cuidado com o número de interações, pois muitas imagens podem lotar facilmente a memória RAM
+        with medeFase(self.perfilador, 'gif'):
+            imageio.mimsave(f'{self.nome_gif}.gif', self.images, fps=15) # Gera um gif com as imagens geradas. Deve-se tomar cuidado com o número de interações, pois muitas imagens podem lotar facilmente a memória RAM
 
         elapsed = time.time() - start # Calcula o tempo de render do gif
         print(f"Fim do render: {elapsed}s")
 
-    def geraGif(self, modelo, epsilon = 1e-6): # Método que gera o gif animado. Recebe como parâmetro o modelo, e uma tolerância epsilon
+    def geraGif(self, modelo, epsilon = 1e-6, norma = 'inf', campos = ('dinheiro',), checkpoint = None): # Método que gera o gif animado. Recebe como parâmetro o modelo, uma tolerância epsilon e o critério de convergência (ver KellerSegelModel.atualizaAteConvergir); com checkpoint, retoma e grava checkpoints como o geraGifHeatMap
         print(f"Iniciando processamento...")
         start = time.time() # Salva o tempo inicial de processamento do modelo
 
-        x = modelo.parametros.x
-        y = modelo.parametros.y
+        x, y = modelo.parametros.malha() # Malha construída uma vez, e não a cada frame
         populacao, dinheiro, _ = modelo.getEstado()
 
         self.max_pop = populacao.max()
@@ -251,45 +1559,140 @@ class AnimacaoTool():
         self.max_mon = dinheiro.max()
         self.min_mon = dinheiro.min()
 
-        self.plotEstadoModelo(x, y, populacao, dinheiro) # Plota o estado inicial
-        self.salvaFrame() # Salva o frame
-
-        erro = 999
+        if not self.__retomaCheckpoint(checkpoint, modelo):
+            self.plotEstadoModelo(x, y, populacao, dinheiro) # Plota o estado inicial
+            self.salvaFrame() # Salva o frame
+            self.__guardaQuadro(checkpoint)
 
         print(f"População: {modelo.contagemPopulacao()}") # Esse trecho de código serve para acompanhar se a população está se mantendo fixa, em consonância com o modelo
         print(f"Dinheiro: {modelo.contagemDinheiro()}\n") # Mostra o dinheiro líquido inicial
 
-        while erro >= epsilon:
-            modelo.atualizaEstadoMultiplasVezes(n = 10) # Intera dez vezes o estado do modelo
-            p, d, _ = modelo.getEstado() # Pega os valores da população e dinheiro
+        def salvaVerificacao(modelo, erro): # Chamado pelo modelo a cada verificação de convergência (a cada 10 passos)
+            p, d, _ = modelo.getEstado(copia = False) # Pega os valores da população e dinheiro
 
             self.plotEstadoModelo(x, y, p, d) # Plota o estado atual
             self.salvaFrame() # Salva o frame
-
-            erro = self.__erro(dinheiro, d) # Calcula o erro
-            dinheiro = d # atualiza a variável de comparação
+            self.__guardaQuadro(checkpoint, modelo)
 
             print(f"Erro atual: {erro}") # Mostra o erro para verificar se o modelo está convergindo
             print(f"População Atual: {modelo.contagemPopulacao()}") # Verifica a população
             print(f"Dinheiro Atual: {modelo.contagemDinheiro()}\n") # Mostra o dinheiro líquido
 
+        modelo.atualizaAteConvergir(epsilon, norma = norma, campos = campos, intervalo = 10, callback = salvaVerificacao)
+
+        self.fechaFigura()
+
         elapsed = time.time() - start # Calcula o tempo de processamento
         print(f"Fim do processamento: {elapsed}s")
 
         print(f"Iniciando render...")
         start = time.time() # Salva o tempo inicial de render
 
-        imageio.mimsave(f'{self.nome_gif}.gif', self.images, fps=20) # Gera um gif com as imagens geradas. Deve-se tomar cuidado com o número de interações, pois muitas imagens podem lotar facilmente a memória RAM
+        with medeFase(self.perfilador, 'gif'):
+            imageio.mimsave(f'{self.nome_gif}.gif', self.images, fps=20) # Gera um gif com as imagens geradas. Deve-se tomar cuidado com o número de interações, pois muitas imagens podem lotar facilmente a memória RAM
 
         elapsed = time.time() - start # Calcula o tempo de render do gif
         print(f"Fim do render: {elapsed}s")
 
+    def geraGifParalelo(self, modelo, epsilon = 1e-6, norma = 'inf', campos = ('dinheiro',), heat_map = False, processos = None, tamanho_fila = None, formato = 'gif'): # Como geraGif, mas os frames são renderizados por um pool de processos e codificados por uma thread própria enquanto a simulação continua
+        print(f"Iniciando processamento...")
+        start = time.time()
+
+        processos = processos or os.cpu_count()
+        tamanho_fila = tamanho_fila or 2 * processos # Máximo de frames pendentes; acima disso a simulação espera os renderizadores
+
+        x, y = modelo.parametros.malha() # Malha construída uma vez, e não a cada frame
+        populacao, dinheiro, _ = modelo.getEstado()
+
+        avisaForkDepoisDoNumba()
+        fila = queue.Queue(maxsize=tamanho_fila) # Resultados assíncronos na ordem dos frames; cheia, a simulação espera
+        falhas = [] # Exceção da thread escritora, relançada na thread principal
+        n_frames = 0
+
+        with multiprocessing.Pool(processos, initializer=inicializaRenderizador, initargs=(self.nome_gif, x, y, self.orcamento, self.reducao)) as pool, \
+             imageio.get_writer(f'{self.nome_gif}.{formato}', fps=20) as writer:
+
+            def escreveFrames(): # Thread escritora: espera cada frame na ordem e o codifica, sem segurar a simulação
+                while True:
+                    resultado = fila.get()
+                    if resultado is None:
+                        return
+                    if falhas: # Depois de uma falha só esvazia a fila, para a simulação não travar esperando espaço
+                        continue
+                    try:
+                        writer.append_data(resultado.get())
+                    except BaseException as e:
+                        falhas.append(e)
+
+            escritora = threading.Thread(target=escreveFrames, daemon=True)
+            escritora.start()
+
+            def enviaFrame(p, d): # Coloca o estado na fila dos renderizadores (cópias, pois o modelo continua avançando)
+                nonlocal n_frames
+                if falhas:
+                    raise falhas[0]
+                fila.put(pool.apply_async(renderizaFrame, ((np.array(p), np.array(d), heat_map),)))
+                n_frames += 1
+
+            try:
+                enviaFrame(populacao, dinheiro) # Estado inicial
+
+                def enviaVerificacao(modelo, erro):
+                    p, d, _ = modelo.getEstado(copia = False)
+                    enviaFrame(p, d)
+
+                modelo.atualizaAteConvergir(epsilon, norma = norma, campos = campos, intervalo = 10, callback = enviaVerificacao)
+
+                elapsed = time.time() - start
+                print(f"Fim do processamento: {elapsed}s")
+            finally:
+                fila.put(None) # A thread escritora termina os frames que ainda estão na fila e sai
+                escritora.join()
+
+            if falhas:
+                raise falhas[0]
+
+        elapsed = time.time() - start
+        print(f"Fim do render: {elapsed}s ({n_frames} frames)")
+
+    def geraGifDeSnapshots(self, caminho, x, y): # Gera o gif a partir de snapshots gravados pelo SnapshotTool, sem simular de novo; x e y podem ser as coordenadas ou parametros.malha()
+        x, y = malhaPlot(x, y)
+        for populacao, dinheiro, _ in SnapshotTool.leEstados(caminho):
+            self.plotEstadoModelo(x, y, populacao, dinheiro)
+            self.salvaFrame()
+        self.fechaFigura()
+
+        with medeFase(self.perfilador, 'gif'):
+            imageio.mimsave(f'{self.nome_gif}.gif', self.images, fps=20)
+
+def inicializaRenderizador(nome_gif, x, y, orcamento = None, reducao = 'media'): # Executado uma vez em cada processo renderizador; a malha (x, y) chega aqui, e não em cada frame
+    global _renderizador, _malha
+    matplotlib.use('Agg') # Os renderizadores não têm janela
+    _renderizador = AnimacaoTool(nome_gif, reutiliza_figura = True, orcamento = orcamento, reducao = reducao) # Cada renderizador mantém sua figura entre frames
+    _malha = (x, y)
+
+def renderizaFrame(tarefa): # Renderiza um estado em um frame (array da imagem), dentro de um processo renderizador
+    populacao, dinheiro, heat_map = tarefa
+    x, y = _malha
+    if heat_map:
+        _renderizador.plotHeatMapEstadoModelo(x, y, populacao, dinheiro)
+    else:
+        _renderizador.plotEstadoModelo(x, y, populacao, dinheiro)
+    _renderizador.salvaFrame()
+    return _renderizador.images.pop()
+
 class JpegTool():
-    def __init__(self, nome_imagem):
+    def __init__(self, nome_imagem, perfilador = None, orcamento = None, reducao = 'media'):
+        if reducao not in REDUCOES:
+            raise ValueError(f"Redução desconhecida: {reducao}. Use uma de {REDUCOES}")
+
         self.nome_imagem = nome_imagem
+        self.perfilador = perfilador # Perfilador opcional: mede as fases 'plot' e 'salva'
+        self.orcamento = orcamento # Máximo de pontos por superfície, como no AnimacaoTool
+        self.reducao = reducao
 
     def plotSuperficie(self, ax, x, y, z, cmap, title): # Método que faz um plot da superfície
-        X, Y = np.meshgrid(x, y)
+        X, Y = malhaPlot(x, y)
         ax.set_title(title, fontsize = 15)
         ax.grid(False)
         plot = ax.plot_surface(X, Y, z, cmap=cmap, edgecolor='none', rstride=1, cstride=1, shade=True)
@@ -307,13 +1710,16 @@ class JpegTool():
         self.plotSuperficie(ax, x, y, dinheiro, 'winter', f'Dinheiro (t = {round(tempo)}s)')
 
     def plotEstadosModelo(self, x, y, estados): # Intera sobre os estados de evolução do modelo e plot
-        f = plt.figure(figsize=(20, 7), dpi=290)
-        for i in range(len(estados)):
-            self.__plotDuasSuperficies(f, x, y, estados[i][0], estados[i][1], estados[i][2], i + 1)
+        with medeFase(self.perfilador, 'plot'):
+            f = plt.figure(figsize=(20, 7), dpi=290)
+            for i in range(len(estados)):
+                X, Y, populacao, dinheiro = reduzParaRender(x, y, estados[i][0], estados[i][1], self.orcamento, self.reducao)
+                self.__plotDuasSuperficies(f, X, Y, populacao, dinheiro, estados[i][2], i + 1)
 
     def salvaJpeg(self, sufixo = ''): # salva as 12 superfícies em uma imagem
-        plt.savefig(f"{self.nome_imagem}{sufixo}.png")
-        plt.close()
+        with medeFase(self.perfilador, 'salva'):
+            plt.savefig(f"{self.nome_imagem}{sufixo}.png")
+            plt.close()
 
     def geraJpeg(self, modelo): # Método que gera uma imagem com 6 estados de evolução do modelo. Recebe como parâmetro o modelo
         print(f"Iniciando processamento...")
@@ -321,8 +1727,7 @@ class JpegTool():
 
         m = [] # lista de estados da evolução do modelo
 
-        x = modelo.parametros.x
-        y = modelo.parametros.y
+        x, y = modelo.parametros.malha() # Malha construída uma vez, e não a cada frame
         m.append(modelo.getEstado()) # Salva o estado inicial
 
         self.plotEstadosModelo(x, y, estados = m) # Plota o estado
@@ -367,6 +1772,221 @@ class JpegTool():
         elapsed = time.time() - start # Calcula o tempo de processamento
         print(f"Fim do processamento: {elapsed}s")
 
+class SnapshotTool(): # Grava os estados do modelo em disco à medida que a simulação avança, com memória constante
+    FORMATOS = ('npz', 'hdf5')
+    BYTES_CHUNK_HDF5 = 2 ** 20 # Cada chunk do HDF5 é um snapshot só, ladrilhado na grade até cerca de 1 MiB: acrescentar um snapshot não relê chunks já gravados
+
+    def __init__(self, caminho, formato = 'npz', cadencia = 10, dtype = np.float32, bytes_bloco = 64 * 2 ** 20):
+        if formato not in self.FORMATOS:
+            raise ValueError(f"Formato desconhecido: {formato}. Use um de {self.FORMATOS}")
+        if formato == 'hdf5' and h5py is None:
+            raise ImportError("O formato 'hdf5' requer o pacote h5py")
+
+        self.caminho = caminho # Diretório de blocos .npz, ou arquivo .h5
+        self.formato = formato
+        self.cadencia = cadencia # Passos do modelo entre dois snapshots
+        self.dtype = np.dtype(dtype) # Tipo usado no disco (ex.: float32 para reduzir pela metade o tamanho)
+        self.bytes_bloco = bytes_bloco # Memória do buffer de um bloco .npz (os dois campos); define quantos snapshots cabem nele
+        self.tamanho_bloco = None # Snapshots por bloco, calculado quando o tamanho da grade é conhecido (pelo menos 1)
+
+        self.n_snapshots = 0
+        self.arquivo = None
+        self.buffer = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.fecha()
+
+    def __inicializa(self, formato): # Cria o armazenamento na primeira gravação, quando o tamanho da grade é conhecido
+        bytes_snapshot = 2 * int(np.prod(formato)) * self.dtype.itemsize
+        self.tamanho_bloco = max(1, self.bytes_bloco // bytes_snapshot)
+        if self.formato == 'hdf5':
+            self.arquivo = h5py.File(self.caminho, 'w')
+            lado = int(round((self.BYTES_CHUNK_HDF5 / self.dtype.itemsize) ** (1 / len(formato)))) # 512 em 2D float32, 64 em 3D
+            chunks = (1,) + tuple(min(N, lado) for N in formato)
+            for nome in ('populacao', 'dinheiro'):
+                self.arquivo.create_dataset(nome, shape=(0,) + formato, maxshape=(None,) + formato, dtype=self.dtype,
+                                            chunks=chunks, compression='gzip')
+            self.arquivo.create_dataset('tempo', shape=(0,), maxshape=(None,), dtype=np.float64, chunks=(self.tamanho_bloco,))
+        else:
+            os.makedirs(self.caminho, exist_ok=True)
+            self.buffer = {
+                'populacao': np.empty((self.tamanho_bloco,) + formato, dtype=self.dtype),
+                'dinheiro': np.empty((self.tamanho_bloco,) + formato, dtype=self.dtype),
+                'tempo': np.empty(self.tamanho_bloco, dtype=np.float64),
+            }
+            self.n_buffer = 0
+            self.n_blocos = 0
+
+    def __descarregaBloco(self): # Grava o bloco atual como um .npz comprimido e esvazia o buffer
+        if self.n_buffer == 0:
+            return
+        nome = os.path.join(self.caminho, f'bloco_{self.n_blocos:06d}.npz')
+        np.savez_compressed(nome, **{chave: valor[:self.n_buffer] for chave, valor in self.buffer.items()})
+        self.n_blocos += 1
+        self.n_buffer = 0
+
+    def salvaEstado(self, modelo): # Acrescenta o estado atual do modelo ao armazenamento
+        populacao, dinheiro, tempo = modelo.getEstado(copia = False) # O estado é copiado para o buffer/arquivo logo abaixo
+
+        if self.arquivo is None and self.buffer is None:
+            self.__inicializa(np.shape(populacao))
+
+        if self.formato == 'hdf5':
+            n = self.n_snapshots
+            for nome, valor in (('populacao', populacao), ('dinheiro', dinheiro), ('tempo', tempo)):
+                self.arquivo[nome].resize(n + 1, axis=0)
+                self.arquivo[nome][n] = valor
+        else:
+            self.buffer['populacao'][self.n_buffer] = populacao # A conversão para self.dtype acontece na cópia
+            self.buffer['dinheiro'][self.n_buffer] = dinheiro
+            self.buffer['tempo'][self.n_buffer] = tempo
+            self.n_buffer += 1
+            if self.n_buffer == self.tamanho_bloco:
+                self.__descarregaBloco()
+
+        self.n_snapshots += 1
+
+    def gravaSimulacao(self, modelo, n_passos): # Avança o modelo n_passos, gravando um snapshot a cada self.cadencia passos (e o estado inicial e o final)
+        self.salvaEstado(modelo)
+        for inicio in range(0, n_passos, self.cadencia):
+            modelo.atualizaEstadoMultiplasVezes(n = min(self.cadencia, n_passos - inicio)) # O último intervalo pode ser menor
+            self.salvaEstado(modelo)
+
+    def fecha(self):
+        if self.formato == 'hdf5':
+            if self.arquivo is not None:
+                self.arquivo.close()
+        elif self.buffer is not None:
+            self.__descarregaBloco()
+
+    @staticmethod
+    def leEstados(caminho): # Gerador que devolve (populacao, dinheiro, tempo) na ordem gravada, lendo um bloco por vez
+        if os.path.isdir(caminho):
+            for nome in sorted(os.listdir(caminho)):
+                if not nome.startswith('bloco_'):
+                    continue
+                with np.load(os.path.join(caminho, nome)) as bloco:
+                    for populacao, dinheiro, tempo in zip(bloco['populacao'], bloco['dinheiro'], bloco['tempo']):
+                        yield populacao, dinheiro, float(tempo)
+        else:
+            if h5py is None:
+                raise ImportError("Ler snapshots em HDF5 requer o pacote h5py")
+            with h5py.File(caminho, 'r') as arquivo:
+                for i in range(arquivo['tempo'].shape[0]):
+                    yield arquivo['populacao'][i], arquivo['dinheiro'][i], float(arquivo['tempo'][i])
+
+
+class CheckpointTool(): # Checkpoints periódicos do modelo para retomar simulações longas do ponto exato onde pararam
+    ARGUMENTOS_PARAMETROS = ('L_x', 'L_y', 'D_p', 'D_m', 'ds', 'dt', 'alfa', 'beta', 'gamma', 'L_z') # O que basta para reconstruir ParametrosKellerSegelModel
+
+    def __init__(self, pasta, cadencia = 1000, mantem = 3):
+        self.pasta = pasta # Diretório dos checkpoints (e dos frames, ver salvaQuadro)
+        self.cadencia = cadencia # Passos do modelo entre dois checkpoints
+        self.mantem = mantem # Quantos checkpoints mais recentes ficam no disco; os mais antigos são apagados
+        self.ultimo_passo = None # Passo do último checkpoint gravado ou restaurado
+
+        os.makedirs(pasta, exist_ok=True)
+        for temporario in glob.glob(os.path.join(pasta, '*.tmp')): # Restos de uma gravação interrompida
+            os.remove(temporario)
+
+    @staticmethod
+    def __gravaAtomico(caminho, grava): # Grava em um arquivo temporário e renomeia: um crash no meio nunca deixa um arquivo pela metade
+        temporario = caminho + '.tmp'
+        with open(temporario, 'wb') as f:
+            grava(f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(temporario, caminho)
+
+    def salva(self, modelo, rng = None, extra = None): # Grava o estado completo do modelo; rng é um np.random.Generator opcional e extra um dict serializável em JSON
+        populacao, dinheiro, tempo = modelo.getEstado(copia = False) # np.savez copia os arrays para o arquivo
+        parametros = modelo.parametros
+
+        estado_global = np.random.get_state(legacy=False) # Estado do np.random global (usado pelo 1D_keller_segel.py)
+        meta = {
+            'parametros': {nome: getattr(parametros, nome) for nome in self.ARGUMENTOS_PARAMETROS},
+            'dtype': parametros.dtype.str,
+            'metodo': modelo.metodo,
+            'tempo': tempo,
+            'passos': modelo.passos,
+            'historico_erro': modelo.historico_erro,
+            'historico_dt': modelo.historico_dt,
+            'rng_global': {'bit_generator': estado_global['bit_generator'], 'pos': estado_global['state']['pos'],
+                           'has_gauss': estado_global['has_gauss'], 'gauss': estado_global['gauss']}, # A chave do MT19937 vai como array
+            'rng': rng.bit_generator.state if rng is not None else None,
+            'extra': extra,
+        }
+
+        caminho = os.path.join(self.pasta, f'checkpoint_{modelo.passos:012d}.npz')
+        self.__gravaAtomico(caminho, lambda f: np.savez(f, populacao=populacao, dinheiro=dinheiro, rng_global_chave=estado_global['state']['key'],
+                                                        meta=np.array(json.dumps(meta))))
+        self.ultimo_passo = modelo.passos
+
+        for antigo in self.checkpoints()[:-self.mantem]:
+            os.remove(antigo)
+        return caminho
+
+    def verifica(self, modelo, rng = None, extra = None): # Grava um checkpoint se já se passaram 'cadencia' passos desde o último; devolve True se gravou
+        if self.ultimo_passo is not None and modelo.passos - self.ultimo_passo < self.cadencia:
+            return False
+        self.salva(modelo, rng, extra)
+        return True
+
+    def checkpoints(self): # Caminhos dos checkpoints no disco, do mais antigo ao mais recente
+        return sorted(glob.glob(os.path.join(self.pasta, 'checkpoint_*.npz')))
+
+    @staticmethod
+    def carrega(caminho): # Lê um checkpoint: devolve (populacao, dinheiro, meta)
+        with np.load(caminho) as arquivo:
+            meta = json.loads(str(arquivo['meta']))
+            meta['rng_global']['state'] = {'key': arquivo['rng_global_chave'], 'pos': meta['rng_global'].pop('pos')}
+            return arquivo['populacao'], arquivo['dinheiro'], meta
+
+    def restaura(self, modelo, rng = None): # Coloca o modelo (e os geradores aleatórios) no estado do último checkpoint; devolve o 'extra' gravado, ou None se não há checkpoint
+        checkpoints = self.checkpoints()
+        if not checkpoints:
+            return None
+
+        populacao, dinheiro, meta = self.carrega(checkpoints[-1])
+        gravados = meta['parametros']
+        atuais = {nome: getattr(modelo.parametros, nome) for nome in self.ARGUMENTOS_PARAMETROS}
+        if gravados != atuais or meta['dtype'] != modelo.parametros.dtype.str:
+            raise ValueError(f"O checkpoint {checkpoints[-1]} foi gravado com outros parâmetros: {gravados}")
+
+        modelo.setEstadoInicial(populacao, dinheiro) # Mesmo dtype dos parâmetros: os valores voltam bit a bit
+        modelo.tempo = meta['tempo']
+        modelo.passos = meta['passos']
+        modelo.historico_erro = [tuple(par) for par in meta['historico_erro']]
+        modelo.historico_dt = [tuple(par) for par in meta['historico_dt']]
+
+        np.random.set_state(meta['rng_global'])
+        if rng is not None and meta['rng'] is not None:
+            rng.bit_generator.state = meta['rng']
+
+        self.ultimo_passo = meta['passos']
+        return meta['extra'] if meta['extra'] is not None else {}
+
+    def carregaModelo(self, metodo = None, processos = None, rng = None): # Cria o modelo a partir do último checkpoint; devolve (modelo, extra), ou None se não há checkpoint
+        checkpoints = self.checkpoints()
+        if not checkpoints:
+            return None
+
+        _, _, meta = self.carrega(checkpoints[-1])
+        parametros = ParametrosKellerSegelModel(**meta['parametros'], dtype = meta['dtype'])
+        modelo = KellerSegelModel(parametros, metodo or meta['metodo'], processos)
+        return modelo, self.restaura(modelo, rng)
+
+    def salvaQuadro(self, indice, imagem): # Frames do gif ficam no disco, um arquivo por frame, gravados uma única vez; o checkpoint só guarda quantos são
+        pasta = os.path.join(self.pasta, 'quadros')
+        os.makedirs(pasta, exist_ok=True)
+        self.__gravaAtomico(os.path.join(pasta, f'quadro_{indice:06d}.npy'), lambda f: np.save(f, imagem))
+
+    def carregaQuadros(self, n): # Os n primeiros frames gravados (os que existiam no momento do checkpoint)
+        return [np.load(os.path.join(self.pasta, 'quadros', f'quadro_{indice:06d}.npy')) for indice in range(n)]
+
 
 if __name__ == "__main__":
     L = 100 # Tamanho do Grid
@@ -385,8 +2005,8 @@ if __name__ == "__main__":
     modelo = KellerSegelModel(parametros)
 
     # GERA CONDIÇÕES INICIAIS A SEREM ESTUDADAS #
-    condicao_inicial_populacao = np.matrix(np.full((parametros.N_x, parametros.N_x), 1 / (L ** 2)))
-    condicao_inicial_dinheiro = np.matrix(np.zeros((parametros.N_y, parametros.N_y)))
+    condicao_inicial_populacao = np.full((parametros.N_x, parametros.N_x), 1 / (L ** 2))
+    condicao_inicial_dinheiro = np.zeros((parametros.N_y, parametros.N_y))
 
     condicao_inicial_dinheiro[(0, 0)] = 0.125
     condicao_inicial_dinheiro[(0, 99)] = 0.125
@@ -0,0 +1,182 @@
+import os
+import io
+import sys
+import json
+import time
+import argparse
+import platform
+import warnings
+import matplotlib
+matplotlib.use('Agg') # Mede só a renderização, sem terminal gráfico
+import matplotlib.pyplot as plt
+import imageio
+import numpy as np
+
+# O benchmark roda o kernel numba e depois faz fork (método 'paralelo'); com o TBB isso trava o processo na saída.
+# Definido antes de importar o modelo, e só aqui: a camada de threads do numba é global no processo
+os.environ.setdefault('NUMBA_THREADING_LAYER', 'workqueue')
+
+import KellerSegel_2D
+from KellerSegel_2D import ParametrosKellerSegelModel, KellerSegelModel, AnimacaoTool
+
+TAMANHOS_PADRAO = (64, 128, 256, 512, 1024, 2048, 4096) # Pontos por eixo da grade 2D
+TAMANHOS_RENDER_PADRAO = (64, 128, 256)
+LIMITE_ESCALAR = 128 # O laço escalar é a referência, não um backend: acima disso uma medida leva minutos
+
+def criaModelo(dimensao, tamanho, metodo, dtype, processos = None): # Modelo com os parâmetros do __main__ de KellerSegel_2D.py e condição inicial aleatória
+    # Em 1D a grade tem o mesmo número de células que a 2D (tamanho²), para comparar o custo por célula
+    L_x = tamanho ** 2 if dimensao == 1 else tamanho
+    L_y = tamanho if dimensao >= 2 else None
+    L_z = tamanho if dimensao == 3 else None
+    parametros = ParametrosKellerSegelModel(L_x, L_y, 0.5, 0.5, 1, 0.1, 1.2, 0.03, 1, dtype = dtype, L_z = L_z)
+
+    rng = np.random.default_rng(0)
+    populacao = rng.random(parametros.formato)
+    populacao /= populacao.sum()
+
+    with warnings.catch_warnings():
+        warnings.simplefilter('ignore') # 'numba' sem numba (ou fora do 2D) vira 'vetorizado'; o método efetivo vai no resultado
+        modelo = KellerSegelModel(parametros, metodo, processos)
+    modelo.setEstadoInicial(populacao, np.zeros(parametros.formato))
+    return modelo
+
+def mede(funcao, tempo_minimo): # Repete funcao() (1, 2, 4, ... chamadas por rodada) até somar tempo_minimo segundos; devolve (chamadas, segundos)
+    chamadas, segundos, lote = 0, 0.0, 1
+    while segundos < tempo_minimo:
+        inicio = time.perf_counter()
+        funcao(lote)
+        segundos += time.perf_counter() - inicio
+        chamadas += lote
+        lote *= 2
+    return chamadas, segundos
+
+def benchmarkPasso(dimensao, tamanho, metodo, dtype, tempo_minimo, processos = None): # Passos por segundo de atualizaEstado (ou atualizaEstadoMultiplasVezes no 'paralelo')
+    modelo = criaModelo(dimensao, tamanho, metodo, dtype, processos)
+    try:
+        modelo.atualizaEstado() # Aquecimento: compilação do numba, caches de FFT, início dos processos
+        if modelo.metodo == 'paralelo':
+            passo = lambda n: modelo.atualizaEstadoMultiplasVezes(n = n)
+        else:
+            def passo(n):
+                for _ in range(n):
+                    modelo.atualizaEstado()
+        passos, segundos = mede(passo, tempo_minimo)
+    finally:
+        modelo.fecha()
+
+    celulas = int(np.prod(modelo.parametros.formato))
+    return {
+        'tipo': 'passo',
+        'dimensao': dimensao,
+        'tamanho': tamanho,
+        'celulas': celulas,
+        'metodo': metodo,
+        'metodo_efetivo': modelo.metodo,
+        'dtype': np.dtype(dtype).name,
+        'passos': passos,
+        'segundos': segundos,
+        'passos_por_segundo': passos / segundos,
+        'celulas_por_segundo': passos * celulas / segundos,
+    }
+
+def benchmarkRender(tamanho, tipo, reutiliza_figura, tempo_minimo, orcamento = None): # Frames por segundo do plot + captura, sem nenhum passo do modelo
+    modelo = criaModelo(2, tamanho, 'vetorizado', np.float64)
+    modelo.atualizaEstadoMultiplasVezes(n = 10)
+    x, y = modelo.parametros.malha()
+    populacao, dinheiro, _ = modelo.getEstado()
+
+    ferramenta = AnimacaoTool('benchmark', reutiliza_figura = reutiliza_figura, orcamento = orcamento)
+    plot = ferramenta.plotHeatMapEstadoModelo if tipo == 'heat_map' else ferramenta.plotEstadoModelo
+
+    def frame(n):
+        for _ in range(n):
+            plot(x, y, populacao, dinheiro)
+            ferramenta.salvaFrame()
+
+    frame(1) # Aquecimento: criação da figura quando ela é reaproveitada
+    frames, segundos = mede(frame, tempo_minimo)
+
+    # Codificação do gif com os frames gerados, em memória
+    inicio = time.perf_counter()
+    imageio.mimsave(io.BytesIO(), ferramenta.images, format='gif', fps=20)
+    segundos_gif = time.perf_counter() - inicio
+
+    ferramenta.fechaFigura()
+    plt.close('all')
+    return {
+        'tipo': 'render',
+        'tamanho': tamanho,
+        'plot': tipo,
+        'reutiliza_figura': reutiliza_figura,
+        'orcamento': orcamento,
+        'frames': frames,
+        'segundos': segundos,
+        'frames_por_segundo': frames / segundos,
+        'segundos_gif_por_frame': segundos_gif / len(ferramenta.images),
+    }
+
+def ambiente(): # Contexto da medida, gravado junto com os resultados
+    return {
+        'tipo': 'ambiente',
+        'python': platform.python_version(),
+        'numpy': np.__version__,
+        'numba': KellerSegel_2D.numba.__version__ if KellerSegel_2D.numba is not None else None,
+        'plataforma': platform.platform(),
+        'processador': platform.processor(),
+        'nucleos': os.cpu_count(),
+        'data': time.strftime('%Y-%m-%dT%H:%M:%S'),
+    }
+
+def executa(dimensoes, tamanhos, metodos, dtypes, tamanhos_render, tempo_minimo, processos, arquivo, orcamento_render = None): # Roda as combinações e grava um JSON por linha assim que cada medida termina
+    resultados = []
+
+    def registra(resultado):
+        resultados.append(resultado)
+        if arquivo is not None:
+            arquivo.write(json.dumps(resultado) + '\n')
+            arquivo.flush()
+
+    registra(ambiente())
+
+    for dimensao in dimensoes:
+        for tamanho in tamanhos:
+            for metodo in metodos:
+                if metodo == 'escalar' and (dimensao != 2 or tamanho > LIMITE_ESCALAR):
+                    continue
+                for dtype in dtypes:
+                    try:
+                        resultado = benchmarkPasso(dimensao, tamanho, metodo, dtype, tempo_minimo, processos)
+                        print(f"{dimensao}D {tamanho:>5} {metodo:>10} {resultado['metodo_efetivo']:>10} {resultado['dtype']:>7}: "
+                              f"{resultado['passos_por_segundo']:12.2f} passos/s  {resultado['celulas_por_segundo']:.3e} células/s")
+                    except MemoryError:
+                        resultado = {'tipo': 'passo', 'dimensao': dimensao, 'tamanho': tamanho, 'metodo': metodo, 'dtype': np.dtype(dtype).name,
+                                     'erro': 'MemoryError'}
+                        print(f"{dimensao}D {tamanho:>5} {metodo:>10} {np.dtype(dtype).name:>7}: sem memória", file=sys.stderr)
+                    registra(resultado)
+
+    for tamanho in tamanhos_render:
+        for tipo in ('heat_map', 'superficie'):
+            for reutiliza_figura in (False, True):
+                resultado = benchmarkRender(tamanho, tipo, reutiliza_figura, tempo_minimo, orcamento_render)
+                print(f"render {tamanho:>5} {tipo:>10} reutiliza={reutiliza_figura!s:>5}: {resultado['frames_por_segundo']:8.2f} frames/s, "
+                      f"gif {1000 * resultado['segundos_gif_por_frame']:.1f} ms/frame")
+                registra(resultado)
+
+    return resultados
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Benchmark do modelo de Keller-Segel: passos por segundo por tamanho de grade, dtype e método, e custo de renderização medido à parte')
+    parser.add_argument('--dimensoes', type=int, nargs='+', default=[1, 2], choices=[1, 2, 3], help='Dimensões da grade (em 1D a grade tem tamanho² células)')
+    parser.add_argument('--tamanhos', type=int, nargs='+', default=list(TAMANHOS_PADRAO), help='Pontos por eixo')
+    parser.add_argument('--metodos', nargs='+', default=['vetorizado', 'numba', 'imex', 'espectral', 'paralelo', 'escalar'],
+                        choices=KellerSegelModel.METODOS, help=f"Métodos medidos ('escalar' só em 2D até {LIMITE_ESCALAR}²)")
+    parser.add_argument('--dtypes', nargs='+', default=['float64', 'float32'], choices=['float64', 'float32'])
+    parser.add_argument('--tamanhos-render', type=int, nargs='*', default=list(TAMANHOS_RENDER_PADRAO), help='Tamanhos medidos na renderização (nenhum para pular)')
+    parser.add_argument('--orcamento-render', type=int, default=None, help='Máximo de pontos por campo nos plots medidos (padrão: resolução da simulação)')
+    parser.add_argument('--tempo-minimo', type=float, default=1.0, help='Segundos mínimos de medida por combinação')
+    parser.add_argument('--processos', type=int, default=None, help="Processos do método 'paralelo' (padrão: todos os núcleos)")
+    parser.add_argument('--saida', default='benchmark.jsonl', help='Resultados, um JSON por linha (a primeira descreve o ambiente)')
+    args = parser.parse_args()
+
+    with open(args.saida, 'w') as arquivo:
+        executa(args.dimensoes, args.tamanhos, args.metodos, args.dtypes, args.tamanhos_render, args.tempo_minimo, args.processos, arquivo, args.orcamento_render)
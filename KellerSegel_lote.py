@@ -0,0 +1,205 @@
+import os
+import sys
+import json
+import argparse
+import traceback
+import multiprocessing
+import matplotlib
+matplotlib.use('Agg') # Execução sem terminal gráfico
+import imageio
+import numpy as np
+
+# Um lote pode rodar um cenário 'numba' e depois um 'paralelo' no mesmo processo; com o TBB, o fork do segundo trava o processo na saída.
+# Definido antes de importar o modelo, e só aqui: a camada de threads do numba é global no processo
+os.environ.setdefault('NUMBA_THREADING_LAYER', 'workqueue')
+
+from KellerSegel_2D import ParametrosKellerSegelModel, KellerSegelModel, AnimacaoTool, JpegTool, SnapshotTool
+
+FORMATOS_SAIDA = ('gif', 'heat_map', 'png', 'npz', 'hdf5', 'nenhum')
+FORMATOS_GRAFICOS = ('gif', 'heat_map', 'png') # Só para grades 2D; em 1D e 3D use 'npz', 'hdf5' ou 'nenhum'
+
+PARAMETROS_PADRAO = {'dimensao': 2, 'L': 100, 'D_p': 0.5, 'D_m': 0.5, 'ds': 1, 'dt': 0.3, 'alfa': 1.2, 'beta': 0.03, 'gamma': 1} # Valores do __main__ de KellerSegel_2D.py
+
+# Exemplo de cenário (os arquivos de configuração contêm um cenário ou uma lista deles):
+# {
+#     "nome": "distribuicao_1",
+#     "parametros": {"dimensao": 2, "L": 100, "D_p": 0.5, "D_m": 0.5, "ds": 1, "dt": 0.3, "alfa": 1.2, "beta": 0.03, "gamma": 1},
+#     "metodo": "vetorizado",
+#     "condicao_inicial": {
+#         "populacao": {"tipo": "uniforme", "valor": 0.0001},
+#         "dinheiro": {"tipo": "pontos", "pontos": [[49, 49, 2], [0, 0, 0.125]]}
+#     },
+#     "parada": {"epsilon": 1e-9, "norma": "inf", "max_passos": 100000},
+#     (ou "parada": {"estacionario": true, "epsilon": 1e-9}, que resolve o estado estacionário sem marcha no tempo)
+#     "saida": {"formato": "gif", "cadencia": 10}
+# }
+# Nos formatos gráficos, "orcamento" (pontos por campo) e "reducao" ('media' ou 'maximo') reduzem a resolução dos plots; ver reduzParaRender
+
+def geraCampo(config, formato, rng): # Gera uma condição inicial a partir da sua descrição
+    tipo = config.get('tipo', 'zeros')
+    if tipo == 'zeros':
+        return np.zeros(formato)
+    if tipo == 'uniforme': # Valor constante; por padrão normalizado para somar 1
+        return np.full(formato, config.get('valor', 1 / np.prod(formato)))
+    if tipo == 'aleatoria': # Uniforme em [0, 1), opcionalmente normalizada para somar 'total'
+        campo = rng.random(formato)
+        if 'total' in config:
+            campo *= config['total'] / campo.sum()
+        return campo
+    if tipo == 'pontos': # Valores em pontos [i, (j, (k,)) valor] sobre um fundo 'fundo' (padrão 0)
+        campo = np.full(formato, float(config.get('fundo', 0)))
+        for *indice, valor in config['pontos']:
+            campo[tuple(indice)] = valor
+        return campo
+    raise ValueError(f"Tipo de condição inicial desconhecido: {tipo}")
+
+def executaCenario(cenario, pasta_saida, seed): # Roda um cenário do início ao fim, sem interação, e devolve o resumo
+    nome = cenario['nome']
+    p = {**PARAMETROS_PADRAO, **cenario.get('parametros', {})}
+    dimensao = p['dimensao'] # 1, 2 ou 3; o tamanho em cada eixo é L_x, L_y, L_z ou, na falta deles, L
+    L_x = p.get('L_x', p.get('L'))
+    L_y = p.get('L_y', p.get('L')) if dimensao > 1 else None
+    L_z = p.get('L_z', p.get('L')) if dimensao > 2 else None
+    parametros = ParametrosKellerSegelModel(L_x, L_y, p['D_p'], p['D_m'], p['ds'], p['dt'], p['alfa'], p['beta'], p['gamma'],
+                                            dtype = p.get('dtype', 'float64'), L_z = L_z)
+
+    modelo = KellerSegelModel(parametros, cenario.get('metodo', 'vetorizado'), ladrilho = cenario.get('ladrilho', 32), limiar = cenario.get('limiar', 0.0)) # ladrilho e limiar: só no método 'esparso'
+    rng = np.random.default_rng(seed) # Semente fixa por cenário: o lote é reprodutível
+    formato_grade = parametros.formato
+    condicao = cenario.get('condicao_inicial', {})
+    modelo.setEstadoInicial(geraCampo(condicao.get('populacao', {'tipo': 'uniforme'}), formato_grade, rng),
+                            geraCampo(condicao.get('dinheiro', {'tipo': 'zeros'}), formato_grade, rng))
+
+    saida = cenario.get('saida', {})
+    formato = saida.get('formato', 'npz')
+    cadencia = saida.get('cadencia', 10)
+    if formato not in FORMATOS_SAIDA:
+        raise ValueError(f"Formato de saída desconhecido: {formato}. Use um de {FORMATOS_SAIDA}")
+    if formato in FORMATOS_GRAFICOS and dimensao != 2:
+        raise ValueError(f"O formato '{formato}' só existe para grades 2D")
+
+    caminho = os.path.join(pasta_saida, nome)
+    x, y = parametros.malha() if dimensao == 2 else (None, None) # Malha dos plots, construída uma vez
+
+    # Cada formato define como registrar um estado (a cada 'cadencia' passos) e como finalizar a saída
+    if formato in ('gif', 'heat_map'):
+        ferramenta = AnimacaoTool(caminho, reutiliza_figura = True, orcamento = saida.get('orcamento'), reducao = saida.get('reducao', 'media'))
+        plot = ferramenta.plotHeatMapEstadoModelo if formato == 'heat_map' else ferramenta.plotEstadoModelo
+
+        def registra(modelo):
+            populacao, dinheiro, _ = modelo.getEstado(copia = False)
+            plot(x, y, populacao, dinheiro)
+            ferramenta.salvaFrame()
+
+        def finaliza():
+            ferramenta.fechaFigura()
+            imageio.mimsave(f'{caminho}.gif', ferramenta.images, fps=20)
+    elif formato == 'png':
+        ferramenta = JpegTool(caminho, orcamento = saida.get('orcamento'), reducao = saida.get('reducao', 'media'))
+        estados = []
+
+        def registra(modelo): # O JpegTool tem 6 colunas: guarda até 5 estados e o final
+            if len(estados) < 5:
+                estados.append(modelo.getEstado())
+
+        def finaliza():
+            ferramenta.plotEstadosModelo(x, y, estados + [modelo.getEstado()])
+            ferramenta.salvaJpeg()
+    elif formato in ('npz', 'hdf5'):
+        ferramenta = SnapshotTool(caminho + ('.h5' if formato == 'hdf5' else ''), formato = formato, cadencia = cadencia,
+                                  dtype = saida.get('dtype', 'float32'))
+        registra = ferramenta.salvaEstado
+        finaliza = ferramenta.fecha
+    else:
+        registra = lambda modelo: None
+        finaliza = lambda: None
+
+    registra(modelo) # Estado inicial
+
+    parada = cenario.get('parada', {'passos': 1000})
+    if parada.get('estacionario'): # Resolve o estado estacionário direto, sem marcha no tempo (ver KellerSegelModel.resolveEstacionario)
+        epsilon = parada.get('epsilon', 1e-9)
+        historico = modelo.resolveEstacionario(epsilon, niveis = parada.get('niveis', 0), max_iteracoes = parada.get('max_iteracoes', 200))[2]
+        convergiu = historico[-1][1] < epsilon
+        passos = 0
+        registra(modelo)
+    elif 'epsilon' in parada:
+        convergiu = modelo.atualizaAteConvergir(parada['epsilon'], norma = parada.get('norma', 'inf'),
+                                                campos = tuple(parada.get('campos', ('populacao', 'dinheiro'))),
+                                                intervalo = cadencia, max_passos = parada.get('max_passos'),
+                                                callback = lambda modelo, erro: registra(modelo))
+        passos = modelo.passos
+    else:
+        convergiu = None
+        passos = 0
+        while passos < parada['passos']:
+            n = min(cadencia, parada['passos'] - passos)
+            modelo.atualizaEstadoMultiplasVezes(n = n)
+            passos += n
+            registra(modelo)
+
+    finaliza()
+    modelo.fecha()
+
+    resumo = {
+        'nome': nome,
+        'seed': seed,
+        'passos': passos,
+        'tempo': modelo.tempo,
+        'convergiu': convergiu,
+        'populacao_final': float(modelo.contagemPopulacao()),
+        'dinheiro_final': float(modelo.contagemDinheiro()),
+    }
+    with open(f'{caminho}_resumo.json', 'w') as f:
+        json.dump(resumo, f, indent=4)
+    return resumo
+
+def executaTarefa(tarefa): # Envolve executaCenario para que a falha de um cenário não interrompa o lote
+    indice, cenario, pasta_saida, seed = tarefa
+    try:
+        return executaCenario(cenario, pasta_saida, seed + indice)
+    except Exception:
+        return {'nome': cenario.get('nome', str(indice)), 'erro': traceback.format_exc()}
+
+def carregaCenarios(arquivos): # Cada arquivo JSON contém um cenário ou uma lista de cenários
+    cenarios = []
+    for arquivo in arquivos:
+        with open(arquivo) as f:
+            conteudo = json.load(f)
+        cenarios.extend(conteudo if isinstance(conteudo, list) else [conteudo])
+    for indice, cenario in enumerate(cenarios):
+        cenario.setdefault('nome', f'cenario_{indice}')
+    return cenarios
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Executa em lote, sem interação, cenários do modelo de Keller-Segel (1D, 2D ou 3D) descritos em JSON')
+    parser.add_argument('configuracoes', nargs='+', help='Arquivos JSON de cenários')
+    parser.add_argument('--saida', default='.', help='Pasta onde os resultados são gravados')
+    parser.add_argument('--seed', type=int, default=0, help='Semente base; o cenário i usa seed + i')
+    parser.add_argument('--processos', type=int, default=1, help='Cenários executados em paralelo')
+    args = parser.parse_args()
+
+    os.makedirs(args.saida, exist_ok=True)
+    tarefas = [(indice, cenario, args.saida, args.seed) for indice, cenario in enumerate(carregaCenarios(args.configuracoes))]
+
+    if args.processos > 1: # Os processos do Pool são daemônicos e não podem criar os processos do método 'paralelo'
+        paralelos = [cenario['nome'] for _, cenario, _, _ in tarefas if cenario.get('metodo') == 'paralelo']
+        if paralelos:
+            parser.error(f"--processos > 1 não combina com o método 'paralelo' (cenários {', '.join(paralelos)}); "
+                         "use --processos 1 ou outro método nesses cenários")
+
+    if args.processos > 1:
+        with multiprocessing.Pool(args.processos) as pool:
+            resultados = pool.map(executaTarefa, tarefas)
+    else:
+        resultados = [executaTarefa(tarefa) for tarefa in tarefas]
+
+    falhas = 0
+    for resultado in resultados:
+        if 'erro' in resultado:
+            falhas += 1
+            print(f"Cenário {resultado['nome']} falhou:\n{resultado['erro']}", file=sys.stderr)
+        else:
+            print(f"Cenário {resultado['nome']} concluído: {resultado['passos']} passos, t = {resultado['tempo']}")
+
+    sys.exit(1 if falhas else 0)
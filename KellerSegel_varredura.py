@@ -0,0 +1,194 @@
+import os
+import json
+import hashlib
+import argparse
+import traceback
+import itertools
+import multiprocessing
+import numpy as np
+
+from KellerSegel_2D import ParametrosKellerSegelModel, KellerSegelModel
+
+NOMES_VARREDURA = ('alfa', 'beta', 'gamma', 'D_p', 'D_m') # Parâmetros que podem ser varridos
+
+FONTES_DINHEIRO = ( # Fontes pontuais de dinheiro do __main__ de KellerSegel_2D.py, em posições de uma grade 100 x 100
+    ((0, 0), 0.125), ((0, 99), 0.125), ((99, 99), 0.125), ((99, 0), 0.125),
+    ((49, 49), 2), ((49, 69), 1), ((49, 29), 1), ((69, 49), 1), ((29, 49), 1),
+)
+
+def condicaoInicialUniforme(parametros, seed): # População homogênea e as fontes pontuais de dinheiro do __main__ de KellerSegel_2D.py
+    populacao = np.full((parametros.N_x, parametros.N_y), 1 / (parametros.N_x * parametros.N_y))
+    dinheiro = np.zeros((parametros.N_x, parametros.N_y))
+    for (i, j), valor in FONTES_DINHEIRO: # Reescala as posições para grades de outro tamanho
+        dinheiro[i * parametros.N_x // 100, j * parametros.N_y // 100] = valor
+    return populacao, dinheiro
+
+def condicaoInicialAleatoria(parametros, seed): # População aleatória normalizada e sem dinheiro
+    rng = np.random.default_rng(seed)
+    populacao = rng.random((parametros.N_x, parametros.N_y))
+    populacao /= populacao.sum()
+    dinheiro = np.zeros((parametros.N_x, parametros.N_y))
+    return populacao, dinheiro
+
+CONDICOES_INICIAIS = {
+    'uniforme': condicaoInicialUniforme,
+    'aleatoria': condicaoInicialAleatoria,
+}
+
+def geraGrade(valores): # Produto cartesiano de {nome: [valores]} em uma lista de dicionários
+    nomes = list(valores.keys())
+    return [dict(zip(nomes, combinacao)) for combinacao in itertools.product(*(valores[nome] for nome in nomes))]
+
+def executaSimulacao(tarefa): # Roda uma simulação até convergir (ou até max_passos) e devolve as métricas resumidas
+    indice, combinacao, config = tarefa
+
+    parametros = ParametrosKellerSegelModel(config['L_x'], config['L_y'], combinacao['D_p'], combinacao['D_m'],
+                                            config['ds'], config['dt'], combinacao['alfa'], combinacao['beta'], combinacao['gamma'])
+    modelo = KellerSegelModel(parametros)
+
+    dt_maximo = modelo.dtMaximoEstavel()
+    if config['dt'] > dt_maximo: # O FTCS explode com esse dt: nem vale a pena rodar
+        return resultadoComErro(indice, combinacao, f"dt = {config['dt']} acima do máximo estável {dt_maximo:.6g}")
+
+    populacao, dinheiro = CONDICOES_INICIAIS[config['condicao_inicial']](parametros, config['seed'] + indice)
+    modelo.setEstadoInicial(populacao, dinheiro)
+
+    convergiu = modelo.atualizaAteConvergir(config['epsilon'], norma = config['norma'], intervalo = config['intervalo_verificacao'],
+                                            max_passos = config['max_passos']) # Para sozinho se o estado deixar de ser finito
+    passos = modelo.passos
+    tempo_convergencia = modelo.tempo if convergiu else None
+
+    populacao, dinheiro, tempo = modelo.getEstado(copia = False)
+    if not (np.isfinite(populacao).all() and np.isfinite(dinheiro).all()):
+        return resultadoComErro(indice, combinacao, f"Estado não finito em t = {tempo}", passos = passos, tempo = tempo)
+
+    return {
+        'indice': indice,
+        'parametros': combinacao,
+        'passos': passos,
+        'tempo': tempo,
+        'populacao_final': float(modelo.contagemPopulacao()),
+        'dinheiro_final': float(modelo.contagemDinheiro()),
+        'pico_populacao': float(populacao.max()),
+        'pico_dinheiro': float(dinheiro.max()),
+        'tempo_convergencia': tempo_convergencia, # None quando não convergiu em max_passos
+        'erro': None,
+    }
+
+def executaTarefa(tarefa): # Envolve executaSimulacao para que a falha de uma combinação não interrompa a varredura
+    indice, combinacao, config = tarefa
+    try:
+        return executaSimulacao(tarefa)
+    except Exception:
+        return resultadoComErro(indice, combinacao, traceback.format_exc())
+
+def resultadoComErro(indice, combinacao, erro, passos = 0, tempo = 0.0): # Resultado de uma simulação que não produziu métricas válidas (null no JSON em vez de NaN)
+    return {
+        'indice': indice,
+        'parametros': combinacao,
+        'passos': passos,
+        'tempo': tempo,
+        'populacao_final': None,
+        'dinheiro_final': None,
+        'pico_populacao': None,
+        'pico_dinheiro': None,
+        'tempo_convergencia': None,
+        'erro': erro,
+    }
+
+def chaveConfiguracao(config): # Hash da configuração comum a todas as simulações, gravado em cada resultado
+    return hashlib.sha1(json.dumps(config, sort_keys=True).encode()).hexdigest()[:16]
+
+def chaveSimulacao(indice, combinacao): # Identifica uma simulação pela posição (que define a semente) e pelos parâmetros
+    return json.dumps([indice, combinacao], sort_keys=True)
+
+def simulacoesConcluidas(arquivo_resultados, chave_config): # Lê os resultados já gravados, para retomar uma varredura interrompida
+    if not os.path.exists(arquivo_resultados):
+        return set()
+
+    concluidas = set()
+    with open(arquivo_resultados) as f:
+        for linha in f:
+            try:
+                resultado = json.loads(linha)
+                chave = chaveSimulacao(resultado['indice'], resultado['parametros'])
+            except (ValueError, KeyError):
+                continue # Linha incompleta de uma execução interrompida
+            if resultado.get('config') != chave_config:
+                raise ValueError(f"{arquivo_resultados} foi gravado com outra configuração (L, ds, dt, condição inicial, critério de parada ou seed); "
+                                 "use outro arquivo de resultados")
+            concluidas.add(chave)
+    return concluidas
+
+def varredura(combinacoes, arquivo_resultados, L_x = 100, L_y = 100, ds = 1, dt = 0.3, condicao_inicial = 'uniforme',
+              epsilon = 1e-6, norma = 'inf', intervalo_verificacao = 10, max_passos = 100000, seed = 0,
+              processos = None, tamanho_lote = None): # Roda todas as combinações em um pool de processos, gravando cada resultado (JSON por linha) assim que termina
+    if condicao_inicial not in CONDICOES_INICIAIS:
+        raise ValueError(f"Condição inicial desconhecida: {condicao_inicial}. Use uma de {tuple(CONDICOES_INICIAIS)}")
+
+    config = {
+        'L_x': L_x,
+        'L_y': L_y,
+        'ds': ds,
+        'dt': dt,
+        'condicao_inicial': condicao_inicial,
+        'epsilon': epsilon,
+        'norma': norma,
+        'intervalo_verificacao': intervalo_verificacao,
+        'max_passos': max_passos,
+        'seed': seed,
+    }
+
+    chave_config = chaveConfiguracao(config)
+    concluidas = simulacoesConcluidas(arquivo_resultados, chave_config)
+    tarefas = [(indice, combinacao, config) for indice, combinacao in enumerate(combinacoes)
+               if chaveSimulacao(indice, combinacao) not in concluidas]
+    print(f"{len(combinacoes) - len(tarefas)} simulações já concluídas, {len(tarefas)} restantes")
+
+    processos = processos or os.cpu_count()
+    tamanho_lote = tamanho_lote or len(tarefas) or 1
+
+    with multiprocessing.Pool(processos) as pool, open(arquivo_resultados, 'a') as f:
+        for inicio in range(0, len(tarefas), tamanho_lote): # Lotes pequenos limitam o trabalho perdido se a varredura for interrompida
+            lote = tarefas[inicio:inicio + tamanho_lote]
+            for resultado in pool.imap_unordered(executaTarefa, lote):
+                f.write(json.dumps(dict(resultado, config = chave_config)) + '\n')
+                f.flush()
+                if resultado['erro'] is None:
+                    print(f"Simulação {resultado['indice']} concluída: {resultado['parametros']}")
+                else:
+                    print(f"Simulação {resultado['indice']} falhou: {resultado['parametros']} ({resultado['erro']})")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Varredura de parâmetros do modelo de Keller-Segel 2D')
+    for nome in NOMES_VARREDURA:
+        parser.add_argument(f'--{nome}', type=float, nargs='+', help=f'Valores de {nome} a varrer')
+    parser.add_argument('--arquivo-parametros', help='JSON com uma lista de combinações {alfa, beta, gamma, D_p, D_m}; substitui a grade')
+    parser.add_argument('--resultados', default='resultados_varredura.jsonl', help='Arquivo de resultados (JSON por linha); é retomado se já existir')
+    parser.add_argument('--L', type=float, default=100, help='Tamanho do grid')
+    parser.add_argument('--ds', type=float, default=1, help='Diferencial espacial')
+    parser.add_argument('--dt', type=float, default=0.3, help='Diferencial temporal')
+    parser.add_argument('--condicao-inicial', default='uniforme', choices=tuple(CONDICOES_INICIAIS))
+    parser.add_argument('--epsilon', type=float, default=1e-6, help='Tolerância de convergência')
+    parser.add_argument('--norma', default='inf', choices=KellerSegelModel.NORMAS, help='Norma usada no critério de convergência')
+    parser.add_argument('--intervalo-verificacao', type=int, default=10, help='Passos entre verificações de convergência')
+    parser.add_argument('--max-passos', type=int, default=100000, help='Número máximo de passos por simulação')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--processos', type=int, default=None, help='Número de processos (padrão: todos os núcleos)')
+    parser.add_argument('--tamanho-lote', type=int, default=None, help='Simulações por lote')
+    args = parser.parse_args()
+
+    if args.arquivo_parametros:
+        with open(args.arquivo_parametros) as f:
+            combinacoes = json.load(f)
+    else:
+        padrao = {'alfa': [1.2], 'beta': [0.03], 'gamma': [1], 'D_p': [0.5], 'D_m': [0.5]} # Valores do __main__ de KellerSegel_2D.py
+        combinacoes = geraGrade({nome: getattr(args, nome) or padrao[nome] for nome in NOMES_VARREDURA})
+
+    try:
+        varredura(combinacoes, args.resultados, L_x = args.L, L_y = args.L, ds = args.ds, dt = args.dt,
+                  condicao_inicial = args.condicao_inicial, epsilon = args.epsilon, norma = args.norma,
+                  intervalo_verificacao = args.intervalo_verificacao, max_passos = args.max_passos,
+                  seed = args.seed, processos = args.processos, tamanho_lote = args.tamanho_lote)
+    except ValueError as e: # Arquivo de resultados de outra configuração
+        parser.error(str(e))